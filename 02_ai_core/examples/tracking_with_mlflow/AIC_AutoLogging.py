@@ -1,40 +1,91 @@
 import mlflow
 import datetime
+import time
+from urllib.parse import urlparse
+from urllib.request import url2pathname
+import numpy as np
 from ai_core_sdk.tracking import Tracking
 from ai_core_sdk.models import Metric, MetricLabel
-        
+
 import os
 
+
+def local_store_path(tracking_uri):
+    """The directory of a local mlflow file store (file: URI or plain path), None for other tracking servers"""
+    parsed = urlparse(tracking_uri)
+    if parsed.scheme == 'file':
+        return url2pathname(parsed.path)
+    if parsed.scheme == '' or len(parsed.scheme) == 1:  # a path, with a drive letter on Windows
+        return tracking_uri
+    return None
+
+
+def read_metric_file(path):
+    """
+    One metric history of the file store, lines of `timestamp value [step]`,
+    as arrays (timestamps in ms, values, steps), parsed at once
+    """
+    with open(path) as f:
+        lines = [line for line in f.read().splitlines() if line.strip()]
+    columns = len(lines[0].split()) if lines else 3
+    fields = np.array(' '.join(lines).split(), dtype=np.float64)
+    if columns not in (2, 3) or len(fields) != columns * len(lines):
+        # Not the same number of fields on every line (files written by different mlflow versions)
+        rows = [line.split() for line in lines]
+        rows = [(float(r[0]), float(r[1]), float(r[2]) if len(r) > 2 else 0.) for r in rows]
+        fields, columns = np.array(rows, dtype=np.float64).reshape(-1), 3
+    fields = fields.reshape(-1, columns)
+    steps = fields[:, 2] if columns == 3 else np.zeros(len(fields))
+    return fields[:, 0].astype(np.int64), fields[:, 1], steps.astype(np.int64)
+
+
+def read_metric_histories(metrics_dir):
+    """All metric histories of a run, from its `metrics` directory in the file store: {key: (timestamps, values, steps)}"""
+    histories = {}
+    for root, dirs, files in os.walk(metrics_dir):
+        for name in files:
+            path = os.path.join(root, name)
+            # Keys with '/' are stored in sub directories
+            key = os.path.relpath(path, metrics_dir).replace(os.sep, '/')
+            histories[key] = read_metric_file(path)
+    return histories
+
+
 class TrackingContext(object):
     """
     The TrackingContext class can be used as a context manager,
     a minimal example:
 
-    > import mlflow 
-    > from sklearn.linear_model import LinearRegression 
-    > from AIC_Autologging import TrackingContext 
+    > import mlflow
+    > from sklearn.linear_model import LinearRegression
+    > from AIC_Autologging import TrackingContext
     >
-    > X = np.array([[1,1],[1,2],[3,3], [5,4]) 
-    > Y = np.dot(X, np.array([1,2]))+2 
-    > model = LinearRegression() 
+    > X = np.array([[1,1],[1,2],[3,3], [5,4])
+    > Y = np.dot(X, np.array([1,2]))+2
+    > model = LinearRegression()
     >
-    > mlflow.sklearn.autolog() 
-    > with TrackingContext(): 
-    >    model.fit(X,y) 
+    > mlflow.sklearn.autolog()
+    > with TrackingContext():
+    >    model.fit(X,y)
 
 
     When executed on AI Core, the tracked metrics from mlflow are passed to
     the SAP AI Tracking SDK and are visualized in AI Launchpad.
 
+    The metric histories are read from the local mlflow file store in one pass
+    and sent in chunks of at most `chunk_size` metrics, each retried up to
+    `max_retries` times.
     """
-    
-    class TrackingContext(object):
-    def __init__(self, experiment_name="experiment"):
+
+    def __init__(self, experiment_name="experiment", chunk_size=1000, max_retries=3, retry_backoff=2.):
         self.ON_AIC = 'AICORE_EXECUTION_ID' in os.environ
         print("AICORE_EXECUTION_ID", self.ON_AIC)
         if self.ON_AIC:
             self.aic_connection = Tracking()
         self.experiment_name = experiment_name
+        self.chunk_size = chunk_size
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
         try:
             self.experiment_id = mlflow.create_experiment(self.experiment_name)
         except:
@@ -43,19 +94,52 @@ class TrackingContext(object):
         cwd = os.getcwd()
         mlflow.set_tracking_uri(f"file:{cwd}/mlruns")
         self.context = mlflow.start_run()
-    
-    def fetch_logged_data(self, run_id, labels):
+
+    def fetch_metric_histories(self, run_id):
+        """{key: (timestamps, values, steps)} of the run, from the file store, or with one request per key from other tracking servers"""
+        store = local_store_path(mlflow.get_tracking_uri())
+        if store is not None:
+            metrics_dir = os.path.join(store, self.context.info.experiment_id, run_id, 'metrics')
+            if os.path.isdir(metrics_dir):
+                return read_metric_histories(metrics_dir)
+
         client = mlflow.tracking.MlflowClient()
-        data = client.get_run(run_id).data
-        metrics = []
-        for k in data.metrics.keys():
-            for m in client.get_metric_history(run_id, k):
-                date = datetime.datetime.fromtimestamp(m.timestamp/1000.)#.strftime("%Y-%m-%dT%H:%M:%S.%fZ")
-                #metrics.append([{'name': m.key, 'value':m.value,
-                #    'timestamp': date, 'step': m.step,'labels':labels}])
-                metrics.append(Metric(name=m.key, value=m.value, timestamp=date, step=m.step, labels=labels))
-        return metrics
-        
+        histories = {}
+        for k in client.get_run(run_id).data.metrics.keys():
+            history = client.get_metric_history(run_id, k)
+            histories[k] = (np.array([m.timestamp for m in history], dtype=np.int64),
+                            np.array([m.value for m in history], dtype=np.float64),
+                            np.array([m.step for m in history], dtype=np.int64))
+        return histories
+
+    def metric_chunks(self, run_id, labels):
+        """The metrics of the run, as lists of at most `chunk_size` Metric, created chunk by chunk"""
+        chunk = []
+        for key, (timestamps, values, steps) in self.fetch_metric_histories(run_id).items():
+            # Converted for the whole history at once; timestamps are in ms since the epoch (UTC)
+            dates = timestamps.astype('datetime64[ms]').astype(datetime.datetime)
+            for date, value, step in zip(dates, values.tolist(), steps.tolist()):
+                chunk.append(Metric(name=key, value=value, timestamp=date, step=step, labels=labels))
+                if len(chunk) == self.chunk_size:
+                    yield chunk
+                    chunk = []
+        if chunk:
+            yield chunk
+
+    def fetch_logged_data(self, run_id, labels):
+        return [metric for chunk in self.metric_chunks(run_id, labels) for metric in chunk]
+
+    def log_metrics(self, metrics):
+        for attempt in range(self.max_retries + 1):
+            try:
+                return self.aic_connection.log_metrics(metrics)
+            except Exception as error:
+                if attempt == self.max_retries:
+                    raise
+                wait = self.retry_backoff * 2 ** attempt
+                print(f"Logging {len(metrics)} metrics failed ({error}), retrying in {wait:.0f}s")
+                time.sleep(wait)
+
     def __enter__(self):
         self.context.__enter__()
         return self
@@ -67,9 +151,9 @@ class TrackingContext(object):
                 MetricLabel(name="experiment_id", value=self.experiment_id),
                 MetricLabel(name="run_id", value=self.context.info.run_id)]
 
-        data = self.fetch_logged_data(self.context.info.run_id,labels)
-        if self.ON_AIC:
-            self.aic_connection.log_metrics(data)
-        else:
-            for el in data:
-                print(el)
+        for chunk in self.metric_chunks(self.context.info.run_id, labels):
+            if self.ON_AIC:
+                self.log_metrics(chunk)
+            else:
+                for el in chunk:
+                    print(el)
@@ -0,0 +1,89 @@
+"""
+Peak RSS and load time of the training data loading, for growing datasets:
+
+    python benchmark_load.py --rows 1000000,10000000,50000000 --workdir /tmp/bench --output load-benchmark.json
+
+Compared methods, each measured in a fresh process:
+
+    pandas      `pd.read_csv(path)` as main.py did before (float64)
+    chunked     data.load_dataset without cache (chunked float32 parsing)
+    convert     data.load_dataset on first use (chunked parsing into the Parquet copy, then reading it)
+    cached      data.load_dataset on later runs (Parquet copy only)
+
+Datasets are generated once per size as `<workdir>/train-<rows>.csv` (50M rows are about 4.5 GB).
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+COLUMNS = ['MedInc', 'HouseAge', 'AveRooms', 'AveBedrms', 'Population', 'AveOccup', 'Latitude', 'Longitude', 'target']
+METHODS = ('pandas', 'chunked', 'convert', 'cached')
+
+# Runs in the child process, prints its load time and peak RSS
+CHILD = """
+import sys, time, json, resource
+sys.path.insert(0, {here!r})
+method, path = {method!r}, {path!r}
+start = time.perf_counter()
+if method == 'pandas':
+    import pandas as pd
+    df = pd.read_csv(path)
+else:
+    from data import load_dataset
+    df = load_dataset(path, cache=method != 'chunked')
+elapsed = time.perf_counter() - start
+print(json.dumps({{"rows": len(df), "seconds": elapsed, "peak_rss_bytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024}}))
+"""
+
+
+def generate_csv(path, rows, chunk_rows=1000000, seed=0):
+    import pyarrow as pa
+    import pyarrow.csv as pacsv
+    rng = np.random.default_rng(seed)
+    with pacsv.CSVWriter(path, pa.schema([(c, pa.float64()) for c in COLUMNS])) as writer:
+        for offset in range(0, rows, chunk_rows):
+            n = min(chunk_rows, rows - offset)
+            values = rng.random((len(COLUMNS), n)) * 100
+            writer.write_table(pa.table(dict(zip(COLUMNS, values))))
+
+
+def measure(method, path):
+    output = subprocess.run([sys.executable, '-c', CHILD.format(here=HERE, method=method, path=path)],
+                            capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=str, default="1000000,10000000,50000000", help="Comma separated dataset sizes")
+    parser.add_argument("--methods", type=str, default=','.join(METHODS))
+    parser.add_argument("--workdir", type=str, default=".", help="Where the generated datasets are kept")
+    parser.add_argument("--output", type=str, default="load-benchmark.json")
+    args = parser.parse_args()
+
+    results = []
+    for rows in map(int, args.rows.split(',')):
+        path = os.path.join(args.workdir, f'train-{rows}.csv')
+        if not os.path.exists(path):
+            print(f"Generating {path}")
+            generate_csv(path, rows)
+        cache_path = path + '.parquet'
+        if os.path.exists(cache_path):
+            os.remove(cache_path) # so `convert` really converts
+        for method in args.methods.split(','):
+            result = {"rows": rows, "method": method, **measure(method, path)}
+            print(f"{rows:>10} rows  {method:<8} {result['seconds']:8.2f} s  {result['peak_rss_bytes'] / 2**20:8.0f} MiB peak RSS")
+            results.append(result)
+
+    with open(args.output, 'w') as fd:
+        json.dump(results, fd, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+Loading of the training dataset.
+
+    CSV              parsed in chunks straight to float32 (no float64 or object columns
+                     on the way), and converted once to a Parquet copy next to it
+                     (`train.csv` -> `train.csv.parquet`). Later runs on the same file
+                     read the copy instead of parsing text again.
+    Parquet / Arrow  read directly, only the requested columns.
+
+To skip text parsing on SAP AI Core as well, upload the Parquet copy (or any
+Parquet file) as the dataset artifact and point DATA_PATH to it.
+"""
+import os
+
+import numpy as np
+import pandas as pd
+
+FLOAT_DTYPE = np.float32
+CHUNK_ROWS = 1000000
+PARQUET_SUFFIXES = ('.parquet', '.pq')
+ARROW_SUFFIXES = ('.arrow', '.feather', '.ipc')
+
+
+def read_columnar(path, columns=None):
+    import pyarrow.parquet as pq
+    import pyarrow.feather as feather
+    if path.endswith(PARQUET_SUFFIXES):
+        table = pq.read_table(path, columns=columns, memory_map=True)
+    else:
+        table = feather.read_table(path, columns=columns, memory_map=True)
+    # self_destruct releases the Arrow buffers column by column while converting
+    return table.to_pandas(split_blocks=True, self_destruct=True)
+
+
+def _source_stamp(path):
+    stat = os.stat(path)
+    return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+
+def cache_path_for(path, cache_dir=None):
+    return os.path.join(cache_dir or os.path.dirname(path), os.path.basename(path) + '.parquet')
+
+
+def read_cached(path, cache_path, columns=None):
+    """
+    Returns:
+        The Parquet copy of `path`, or None if there is none or it is stale.
+    """
+    import pyarrow.parquet as pq
+    if not os.path.exists(cache_path):
+        return None
+    metadata = pq.read_schema(cache_path).metadata or {}
+    if metadata.get(b'source_stamp', b'').decode() != _source_stamp(path):
+        return None
+    return read_columnar(cache_path, columns)
+
+
+def convert_csv(path, cache_path, chunk_rows=CHUNK_ROWS):
+    """
+    Parse `path` chunk by chunk into a Parquet file, so memory holds one chunk at a time
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    tmp_path = cache_path + '.tmp'
+    writer = None
+    try:
+        for chunk in pd.read_csv(path, dtype=FLOAT_DTYPE, chunksize=chunk_rows):
+            table = pa.Table.from_pandas(chunk, preserve_index=False)
+            if writer is None:
+                schema = table.schema.with_metadata({'source_stamp': _source_stamp(path)})
+                writer = pq.ParquetWriter(tmp_path, schema)
+            writer.write_table(table.replace_schema_metadata(schema.metadata))
+    finally:
+        if writer is not None:
+            writer.close()
+    os.replace(tmp_path, cache_path) # never leave a half written copy behind
+
+
+def read_csv_chunked(path, columns=None, chunk_rows=CHUNK_ROWS):
+    chunks = pd.read_csv(path, dtype=FLOAT_DTYPE, usecols=columns, chunksize=chunk_rows)
+    return pd.concat(chunks, ignore_index=True)
+
+
+def load_dataset(path, columns=None, cache=True, cache_dir=None, chunk_rows=CHUNK_ROWS):
+    """
+    Load a CSV, Parquet or Arrow/Feather file as a float32 DataFrame
+
+    Parameters:
+        columns: only load these columns (None for all)
+        cache: convert CSV input once to Parquet and reuse the copy on later runs
+        cache_dir: where to put the Parquet copy, default next to the input
+    """
+    if path.endswith(PARQUET_SUFFIXES + ARROW_SUFFIXES):
+        return read_columnar(path, columns)
+    if not cache:
+        return read_csv_chunked(path, columns, chunk_rows)
+
+    cache_path = cache_path_for(path, cache_dir)
+    df = read_cached(path, cache_path, columns)
+    if df is not None:
+        return df
+    try:
+        convert_csv(path, cache_path, chunk_rows)
+    except OSError as error:
+        # e.g. read-only input directory
+        print(f"Warning: could not write {cache_path} ({error}), parsing the CSV without cache")
+        return read_csv_chunked(path, columns, chunk_rows)
+    return read_columnar(cache_path, columns)
@@ -0,0 +1,230 @@
+"""
+Incremental training: decides whether newly ingested rows need a full retraining.
+
+Every run writes `checkpoint.json` next to the model, with a fingerprint of
+the training file and running statistics of its columns. Mount the model
+artifact of the previous execution and point CHECKPOINT_DIR to it, then:
+
+    - the file is unchanged               -> the previous model is kept
+    - rows were appended to the CSV       -> only the new rows are parsed;
+        estimators with `partial_fit` are updated with them, for the others
+        the previous model is kept unless the new rows drifted by more than
+        DRIFT_THRESHOLD, or the rows added since the last full training
+        exceed RETRAIN_FRACTION of the data
+    - anything else (edited rows, other format, no checkpoint) -> full training
+
+Note that the tutorial's DecisionTreeRegressor (and every configuration of the
+sweep) has no `partial_fit`: with it this is a retrain gate, not incremental
+learning. A kept model is the previous one, unchanged, and does not see the
+appended rows; they are only learned by the next full training, once drift or
+the rows added since then cross a threshold. What is saved is the time of
+parsing the whole file and fitting when little was appended.
+
+Drift is a z-score: how many standard errors the mean or the variance of a
+column of the new rows is away from those of the previous rows (see `drift`).
+DRIFT_THRESHOLD=5 retrains on about 1% of appends of unchanged data, whatever
+their number of rows, and on a shift of half a standard deviation of a column's
+mean from about 100 new rows on.
+"""
+import io
+import os
+import json
+import pickle
+import hashlib
+
+import numpy as np
+import pandas as pd
+
+from data import FLOAT_DTYPE
+
+CHECKPOINT_FILE = 'checkpoint.json'
+HASH_BYTES = 65536
+
+
+def _sha256(fd, start, length):
+    fd.seek(start)
+    return hashlib.sha256(fd.read(length)).hexdigest()
+
+
+def fingerprint(path):
+    """
+    Size and hashes of the first and last bytes; enough to recognise an appended-to file without reading it
+    """
+    size = os.path.getsize(path)
+    with open(path, 'rb') as fd:
+        return {
+            "name": os.path.basename(path),
+            "bytes": size,
+            "head_sha256": _sha256(fd, 0, min(HASH_BYTES, size)),
+            "tail_sha256": _sha256(fd, max(0, size - HASH_BYTES), HASH_BYTES),
+            "ends_with_newline": size > 0 and _tail_byte(fd, size) == b'\n',
+        }
+
+
+def _tail_byte(fd, size):
+    fd.seek(size - 1)
+    return fd.read(1)
+
+
+def appended_since(path, previous):
+    """
+    Returns:
+        True if `path` is the previously fingerprinted file with rows appended (or unchanged).
+    """
+    size = os.path.getsize(path)
+    old_size = previous["bytes"]
+    if size < old_size or not previous.get("ends_with_newline"):
+        return False
+    with open(path, 'rb') as fd:
+        return (_sha256(fd, 0, min(HASH_BYTES, old_size)) == previous["head_sha256"] and
+                _sha256(fd, max(0, old_size - HASH_BYTES), min(HASH_BYTES, old_size)) == previous["tail_sha256"])
+
+
+def read_appended_rows(path, offset):
+    """
+    Parse only the rows after byte `offset`, with the header of the file
+    """
+    with open(path, 'rb') as fd:
+        header = fd.readline()
+        fd.seek(offset)
+        tail = fd.read()
+    return pd.read_csv(io.BytesIO(header + tail), dtype=FLOAT_DTYPE)
+
+
+def column_stats(df):
+    """
+    Count, mean and sums of the 2nd to 4th powers of the deviations of every column
+    """
+    mean, m2, m3, m4 = [], [], [], []
+    for column in df.columns:
+        values = df[column].to_numpy(dtype=np.float64) # one float64 column at a time
+        mean.append(float(values.mean()))
+        deviations = values - mean[-1]
+        squares = deviations ** 2
+        m2.append(float(squares.sum()))
+        m3.append(float((squares * deviations).sum()))
+        m4.append(float((squares ** 2).sum()))
+    return {"columns": list(df.columns), "count": len(df), "mean": mean, "m2": m2, "m3": m3, "m4": m4}
+
+
+def merge_stats(a, b):
+    # Chan et al. / Pébay parallel update of count, mean and the sums of powers of the deviations
+    n_a, n_b = a["count"], b["count"]
+    count = n_a + n_b
+    mean_a, mean_b = np.array(a["mean"]), np.array(b["mean"])
+    m2_a, m2_b = np.array(a["m2"]), np.array(b["m2"])
+    m3_a, m3_b = np.array(a["m3"]), np.array(b["m3"])
+    delta = mean_b - mean_a
+    return {
+        "columns": a["columns"],
+        "count": count,
+        "mean": (mean_a + delta * n_b / count).tolist(),
+        "m2": (m2_a + m2_b + delta ** 2 * n_a * n_b / count).tolist(),
+        "m3": (m3_a + m3_b + delta ** 3 * n_a * n_b * (n_a - n_b) / count ** 2 +
+               3 * delta * (n_a * m2_b - n_b * m2_a) / count).tolist(),
+        "m4": (np.array(a["m4"]) + np.array(b["m4"]) +
+               delta ** 4 * n_a * n_b * (n_a ** 2 - n_a * n_b + n_b ** 2) / count ** 3 +
+               6 * delta ** 2 * (n_a ** 2 * m2_b + n_b ** 2 * m2_a) / count ** 2 +
+               4 * delta * (n_a * m3_b - n_b * m3_a) / count).tolist(),
+    }
+
+
+def drift(reference, new):
+    """
+    Largest z-score, over the columns, of the new rows against the reference data: of their mean, with the
+    standard error std / sqrt(n) of n rows, and of the ratio of their variances, with its standard error for
+    n rows and the kurtosis of the reference. That is, how many standard errors the new rows are away from
+    the reference, so sampling noise alone gives the same scores for 10 or 10000 new rows.
+    """
+    n = new["count"]
+    variance_ref = np.array(reference["m2"]) / max(1, reference["count"] - 1)
+    variance_ref = np.where(variance_ref > 0, variance_ref, 1e-24)
+    shift = np.abs(np.array(new["mean"]) - np.array(reference["mean"])) / np.sqrt(variance_ref / n)
+    if n < 2:
+        return float(shift.max())
+    # var(s² / σ²) = 2 / (n - 1) + (kurtosis - 3) / n: the few outliers of heavy tailed columns make s² noisy
+    kurtosis = np.array(reference["m4"]) / reference["count"] / variance_ref ** 2
+    scale_se = np.sqrt(2 / (n - 1) + np.maximum(kurtosis - 3, 0) / n)
+    scale = np.abs(np.array(new["m2"]) / (n - 1) / variance_ref - 1) / scale_se
+    return float(max(shift.max(), scale.max()))
+
+
+class Update(object):
+    """
+    Outcome of `plan_update`: either `retrain`, or the `model` to save together with the new `checkpoint`
+    """
+
+    def __init__(self, retrain, reason, model=None, checkpoint=None):
+        self.retrain = retrain
+        self.reason = reason
+        self.model = model
+        self.checkpoint = checkpoint
+
+
+def load_checkpoint(checkpoint_dir):
+    path = os.path.join(checkpoint_dir, CHECKPOINT_FILE)
+    model_path = os.path.join(checkpoint_dir, 'model.pkl')
+    if not (os.path.exists(path) and os.path.exists(model_path)):
+        return None, None
+    with open(path) as fd:
+        checkpoint = json.load(fd)
+    with open(model_path, 'rb') as fd:
+        return checkpoint, pickle.load(fd)
+
+
+def plan_update(data_path, checkpoint_dir, drift_threshold=5., retrain_fraction=0.1):
+    """
+    For rows appended to the CSV and a model without `partial_fit`, full training when
+    `drift(stats of the previous rows, new rows) > drift_threshold` (in standard errors) or
+    `rows added since the last full training / all rows > retrain_fraction`, otherwise the
+    previous model is kept as it is. Either threshold at 0 retrains on every appended row,
+    and `drift_threshold=inf` with `retrain_fraction=1` always keeps the previous model.
+    """
+    checkpoint, model = load_checkpoint(checkpoint_dir)
+    if checkpoint is None:
+        return Update(True, "Incremental: no checkpoint found, full training")
+    if "m4" not in checkpoint["stats"]:
+        return Update(True, "Incremental: checkpoint without the statistics for the drift, full training")
+    if not data_path.endswith('.csv') or not appended_since(data_path, checkpoint["data"]):
+        return Update(True, "Incremental: training data was not only appended to, full training")
+
+    new_fingerprint = fingerprint(data_path)
+    if new_fingerprint["bytes"] == checkpoint["data"]["bytes"]:
+        return Update(False, "Incremental: no new rows, keeping the previous model", model,
+                      dict(checkpoint, data=new_fingerprint))
+
+    new_rows = read_appended_rows(data_path, checkpoint["data"]["bytes"])
+    new_stats = column_stats(new_rows)
+    stats = merge_stats(checkpoint["stats"], new_stats)
+    updated = dict(checkpoint, data=new_fingerprint, stats=stats,
+                   rows_since_fit=checkpoint.get("rows_since_fit", 0) + len(new_rows))
+
+    if hasattr(model, 'partial_fit'):
+        model.partial_fit(new_rows.drop('target', axis=1), new_rows['target'])
+        return Update(False, f"Incremental: updated the model with {len(new_rows)} new rows", model, updated)
+
+    # No way to learn the new rows without a full training: keep the previous model, or retrain
+    score = drift(checkpoint["stats"], new_stats)
+    fraction = updated["rows_since_fit"] / stats["count"]
+    if score > drift_threshold:
+        return Update(True, f"Incremental: drift {score:.2f} > DRIFT_THRESHOLD {drift_threshold}, full training")
+    if fraction > retrain_fraction:
+        return Update(True, f"Incremental: {fraction:.1%} rows added since the last training "
+                            f"> RETRAIN_FRACTION {retrain_fraction:.1%}, full training")
+    return Update(False, f"Incremental: {len(new_rows)} new rows, drift {score:.2f} <= {drift_threshold}, "
+                         f"{fraction:.1%} rows since the last training <= {retrain_fraction:.1%}, "
+                         f"keeping the previous model ({type(model).__name__} has no partial_fit, "
+                         f"the new rows are not learned until the next full training)",
+                  model, updated)
+
+
+def new_checkpoint(data_path, df, **extra):
+    """
+    Checkpoint after a full training on `df`, loaded from `data_path`
+    """
+    return {"data": fingerprint(data_path), "stats": column_stats(df), "rows_since_fit": 0, **extra}
+
+
+def save_checkpoint(model_dir, checkpoint):
+    with open(os.path.join(model_dir, CHECKPOINT_FILE), 'w') as fd:
+        json.dump(checkpoint, fd, indent=2)
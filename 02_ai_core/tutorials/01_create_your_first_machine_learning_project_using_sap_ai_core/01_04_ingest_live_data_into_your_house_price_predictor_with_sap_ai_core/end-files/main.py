@@ -1,17 +1,66 @@
-# Specify which base layers (default dependencies) to use
-# You may find more base layers at https://hub.docker.com/
-FROM python:3.7
+import os
 #
-# Creates directory within your Docker image
-RUN mkdir -p /app/src/
+# Variables
+DATA_PATH = os.getenv('DATA_PATH', '/app/data/train.csv') # CSV, Parquet or Arrow/Feather, see data.py
+DT_MAX_DEPTH= os.getenv('DT_MAX_DEPTH') # one depth, or a comma separated list to sweep, e.g. "3,5,8"
+SWEEP_GRID = os.getenv('SWEEP_GRID') # optional, other tree parameters to sweep, e.g. '{"min_samples_leaf": [1, 10]}'
+SWEEP_WORKERS = int(os.getenv('SWEEP_WORKERS', '0')) # processes for the sweep, 0 for all cores
+MODEL_PATH = '/app/model/model.pkl'
+LEADERBOARD_PATH = '/app/model/leaderboard.json'
+CHECKPOINT_DIR = os.getenv('CHECKPOINT_DIR') # optional, model artifact of the previous execution, see incremental.py
+DRIFT_THRESHOLD = float(os.getenv('DRIFT_THRESHOLD', '5')) # full training when the appended rows are more standard errors away, 0 to always retrain
+RETRAIN_FRACTION = float(os.getenv('RETRAIN_FRACTION', '0.1')) # full training once more than this fraction of the rows came after the last one
 #
-# Copies file from your Local system TO path in Docker image
-COPY main.py /app/src/
-COPY requirements.txt /app/src/
+# Incremental mode: keep the previous model when rows were only appended without drift.
+# The decision tree has no partial_fit, a kept model does not learn the new rows (see incremental.py)
+import pickle
+from incremental import plan_update, new_checkpoint, save_checkpoint
+if CHECKPOINT_DIR:
+    update = plan_update(DATA_PATH, CHECKPOINT_DIR, DRIFT_THRESHOLD, RETRAIN_FRACTION)
+    print(update.reason)
+    if not update.retrain:
+        pickle.dump(update.model, open(MODEL_PATH, 'wb'))
+        save_checkpoint(os.path.dirname(MODEL_PATH), update.checkpoint)
+        raise SystemExit(0)
 #
-# Installs dependencies within you Docker image
-RUN pip3 install -r /app/src/requirements.txt
+# Load Datasets
+from data import load_dataset
+df = load_dataset(DATA_PATH) # float32, CSV is parsed in chunks and cached as Parquet next to it
+X = df.drop('target', axis=1)
+y = df['target']
 #
-# Enable permission to execute anything inside the folder app
-RUN chgrp -R 65534 /app && \
-    chmod -R 777 /app
+# Partition into Train and test dataset
+from sklearn.model_selection import train_test_split
+train_x, test_x, train_y, test_y = train_test_split(X, y, test_size=0.3)
+#
+# Configurations to train, more than one turns on the sweep mode
+from sweep import parse_grid, expand_grid, run_sweep
+configs = expand_grid(parse_grid(DT_MAX_DEPTH, SWEEP_GRID))
+#
+if len(configs) == 1:
+    # Init model
+    from sklearn.tree import DecisionTreeRegressor
+    clf = DecisionTreeRegressor(**configs[0])
+    #
+    # Train model
+    clf.fit(train_x, train_y)
+    #
+    # Test model
+    test_r2_score = clf.score(test_x, test_y)
+    # Output will be available in logs of SAP AI Core.
+    # Not the ideal way of storing /reporting metrics in SAP AI Core, but that is not the focus this tutorial
+    print(f"Test Data Score {test_r2_score}")
+    params = configs[0]
+else:
+    # Fit all configurations in parallel on the same data, keep the best model
+    data = (train_x.to_numpy(), train_y.to_numpy(), test_x.to_numpy(), test_y.to_numpy())
+    clf, leaderboard = run_sweep(data, configs, workers=SWEEP_WORKERS)
+    print(f"Best {leaderboard[0]['params']}: Test Data Score {leaderboard[0]['test_r2_score']}")
+    params, test_r2_score = leaderboard[0]['params'], leaderboard[0]['test_r2_score']
+    import json
+    with open(LEADERBOARD_PATH, 'w') as fd:
+        json.dump(leaderboard, fd, indent=2)
+#
+# Save model, with the checkpoint for the next incremental run
+pickle.dump(clf, open(MODEL_PATH, 'wb'))
+save_checkpoint(os.path.dirname(MODEL_PATH), new_checkpoint(DATA_PATH, df, params=params, test_r2_score=test_r2_score))
@@ -0,0 +1,82 @@
+"""
+Hyperparameter sweep of the DecisionTreeRegressor within one execution.
+
+Every configuration is fitted in its own process of a process pool. The
+dataset is loaded once: forked workers inherit it copy-on-write and only
+read it, so it is neither pickled nor copied per configuration.
+"""
+import os
+import json
+import time
+import itertools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from sklearn.tree import DecisionTreeRegressor
+
+# (train_x, train_y, test_x, test_y), set in the parent before forking, or by _init in spawned workers
+_data = None
+
+
+def parse_grid(max_depth=None, grid_json=None):
+    """
+    Build the parameter grid from the DT_MAX_DEPTH ("3" or "3,5,8") and SWEEP_GRID
+    ('{"max_depth": [3, 5], "min_samples_leaf": [1, 10]}') values
+    """
+    grid = json.loads(grid_json) if grid_json else {}
+    if max_depth:
+        grid.setdefault('max_depth', [int(depth) for depth in str(max_depth).split(',')])
+    return {key: values if isinstance(values, list) else [values] for key, values in grid.items()}
+
+
+def expand_grid(grid):
+    keys = sorted(grid)
+    return [dict(zip(keys, values)) for values in itertools.product(*(grid[key] for key in keys))]
+
+
+def cpu_count():
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def _init(data):
+    global _data
+    _data = data
+
+
+def _evaluate(params):
+    train_x, train_y, test_x, test_y = _data
+    start = time.perf_counter()
+    model = DecisionTreeRegressor(**params).fit(train_x, train_y)
+    fit_seconds = time.perf_counter() - start
+    return params, model.score(test_x, test_y), fit_seconds, model
+
+
+def run_sweep(data, configs, workers=None, random_state=0):
+    """
+    Fit and score every configuration in parallel
+
+    Returns:
+        (best model, leaderboard sorted by descending test R2)
+    """
+    global _data
+    workers = min(workers or cpu_count(), len(configs))
+    configs = [{'random_state': random_state, **params} for params in configs]
+    if 'fork' in multiprocessing.get_all_start_methods():
+        _data = data
+        pool = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('fork'))
+    else:
+        pool = ProcessPoolExecutor(workers, initializer=_init, initargs=(data,))
+
+    leaderboard = []
+    best_model, best_score = None, None
+    with pool:
+        for future in as_completed([pool.submit(_evaluate, params) for params in configs]):
+            params, score, fit_seconds, model = future.result()
+            print(f"Sweep {params}: Test Data Score {score} ({fit_seconds:.2f} s)")
+            leaderboard.append({"params": params, "test_r2_score": score, "fit_seconds": fit_seconds})
+            if best_score is None or score > best_score:
+                best_model, best_score = model, score # only the best model is kept in memory
+    leaderboard.sort(key=lambda entry: entry["test_r2_score"], reverse=True)
+    return best_model, leaderboard
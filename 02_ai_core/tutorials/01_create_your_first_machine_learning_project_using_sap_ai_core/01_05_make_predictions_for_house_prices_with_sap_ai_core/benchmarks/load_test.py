@@ -0,0 +1,303 @@
+"""
+Load test for the house price server in `../hello-aicore-serve`.
+
+Trains a tiny DecisionTreeRegressor, starts the server with it, drives
+`/v2/predict` with concurrent clients for a fixed duration and writes
+throughput, latency percentiles, error rate and server RSS to a JSON file.
+
+    # the server from the local sources (gunicorn, see wsgi.py)
+    python load_test.py --server gunicorn --concurrency 16 --duration 30 --output results.json
+
+    # the image before pushing it
+    docker build -t house-server:02 ../hello-aicore-serve
+    python load_test.py --image house-server:02 --label 02 --output results-02.json
+
+    # fail (exit code 1) if throughput dropped or p99 latency grew by more than 10%
+    python load_test.py --image house-server:03 --label 03 --compare results-02.json --max-regression 0.1
+
+Extra environment for the server (BATCH_MAX_SIZE, CACHE_MAX_ENTRIES, ...) is passed with `--env KEY=VALUE`.
+"""
+import os
+import re
+import sys
+import json
+import time
+import pickle
+import socket
+import argparse
+import tempfile
+import threading
+import subprocess
+import http.client
+
+import numpy as np
+from sklearn.tree import DecisionTreeRegressor
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SERVE_DIR = os.path.join(HERE, '..', 'hello-aicore-serve')
+FEATURES = ['MedInc', 'HouseAge', 'AveRooms', 'AveBedrms', 'Population', 'AveOccup', 'Latitude', 'Longitude']
+
+SERVER_COMMANDS = {
+    'flask': [sys.executable, 'main.py'],
+    'gunicorn': [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'wsgi:app'],
+    'asgi': [sys.executable, 'asgi.py'],
+}
+
+
+def train_model(model_dir, n_rows=20000, max_depth=8, seed=0):
+    # California housing-like value ranges, so the requests look like real ones
+    rng = np.random.default_rng(seed)
+    low = np.array([0.5, 1., 1., 0.5, 10., 1., 32.5, -124.3])
+    high = np.array([15., 52., 10., 2., 5000., 6., 42., -114.3])
+    X = rng.uniform(low, high, size=(n_rows, len(FEATURES)))
+    y = 0.4 * X[:, 0] + 0.01 * X[:, 1] + rng.normal(scale=0.3, size=n_rows)
+    model = DecisionTreeRegressor(max_depth=max_depth).fit(X, y)
+    path = os.path.join(model_dir, 'model.pkl')
+    with open(path, 'wb') as fd:
+        pickle.dump(model, fd)
+    return path, X
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class LocalServer(object):
+
+    def __init__(self, kind, model_path, port, env):
+        self.process = subprocess.Popen(
+            SERVER_COMMANDS[kind], cwd=SERVE_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+            # DEBUG=0: no Flask reloader, whose child process would not be stopped with the server
+            env={**os.environ, 'MODEL_PATH': model_path, 'PORT': str(port), 'DEBUG': '0', 'greetingmessage': 'load test', **env})
+        self.port = port
+
+    def rss_bytes(self):
+        # Server process plus its children (gunicorn workers, process pools), Linux only
+        pids = [self.process.pid]
+        total = 0
+        while pids:
+            pid = pids.pop()
+            try:
+                with open(f'/proc/{pid}/status') as fd:
+                    total += int(re.search(r'VmRSS:\s+(\d+) kB', fd.read()).group(1)) * 1024
+                for task in os.listdir(f'/proc/{pid}/task'):
+                    with open(f'/proc/{pid}/task/{task}/children') as fd:
+                        pids.extend(int(child) for child in fd.read().split())
+            except (OSError, AttributeError):
+                continue
+        return total or None
+
+    def stop(self):
+        self.process.terminate()
+        try:
+            self.process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+
+
+class DockerServer(object):
+
+    def __init__(self, image, model_path, port, env, command):
+        self.name = f'house-server-load-test-{port}'
+        args = ['docker', 'run', '--rm', '-d', '--name', self.name, '-p', f'{port}:9001',
+                '-v', f'{os.path.dirname(model_path)}:/mnt/models:ro', '-e', 'greetingmessage=load test']
+        for key, value in env.items():
+            args += ['-e', f'{key}={value}']
+        subprocess.run(args + [image, '/bin/sh', '-c', command], check=True, stdout=subprocess.DEVNULL)
+        self.port = port
+
+    def rss_bytes(self):
+        output = subprocess.run(['docker', 'stats', '--no-stream', '--format', '{{.MemUsage}}', self.name],
+                                capture_output=True, text=True).stdout
+        match = re.match(r'([\d.]+)\s*([KMG]i?B)', output.strip())
+        if match is None:
+            return None
+        unit = {'KiB': 2**10, 'MiB': 2**20, 'GiB': 2**30, 'KB': 10**3, 'MB': 10**6, 'GB': 10**9}[match.group(2)]
+        return int(float(match.group(1)) * unit)
+
+    def stop(self):
+        subprocess.run(['docker', 'stop', self.name], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def wait_ready(port, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+            connection.request('GET', '/v2/greet')
+            if connection.getresponse().status == 200:
+                return
+        except OSError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f'Server did not become ready within {timeout} s')
+
+
+def drive(port, X, concurrency, duration, batch_ratio, batch_size, seed=0):
+    """
+    Runs `concurrency` clients with keep-alive connections for `duration` seconds
+
+    Returns:
+        (latencies in seconds, rows per request, error count, elapsed seconds)
+    """
+    results = [None] * concurrency
+    stop_at = [None]
+    barrier = threading.Barrier(concurrency + 1)
+
+    def client(i):
+        rng = np.random.default_rng(seed + i)
+        connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        latencies, rows, errors = [], [], 0
+        barrier.wait()
+        while time.monotonic() < stop_at[0]:
+            size = batch_size if rng.random() < batch_ratio else 1
+            sample = X[rng.integers(0, len(X), size)]
+            if size == 1:
+                body = json.dumps(dict(zip(FEATURES, sample[0].tolist())))
+            else:
+                body = json.dumps(sample.tolist())
+            start = time.perf_counter()
+            try:
+                connection.request('POST', '/v2/predict', body, {'Content-Type': 'application/json'})
+                response = connection.getresponse()
+                response.read()
+                ok = response.status == 200
+            except (OSError, http.client.HTTPException):
+                ok = False
+                connection.close()
+                connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+            latency = time.perf_counter() - start
+            if ok:
+                latencies.append(latency)
+                rows.append(size)
+            else:
+                errors += 1
+        results[i] = (latencies, rows, errors)
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    start = time.monotonic()
+    stop_at[0] = start + duration
+    barrier.wait()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - start
+
+    latencies = np.array([l for result in results for l in result[0]])
+    rows = np.array([r for result in results for r in result[1]])
+    errors = sum(result[2] for result in results)
+    return latencies, rows, errors, elapsed
+
+
+def summarize(latencies, rows, errors, elapsed):
+    total = len(latencies) + errors
+    summary = {
+        "requests": total,
+        "errors": errors,
+        "error_rate": errors / total if total else 0.0,
+        "throughput_rps": len(latencies) / elapsed,
+        "rows_per_s": float(rows.sum()) / elapsed if len(rows) else 0.0,
+    }
+    if len(latencies):
+        latencies_ms = latencies * 1000.
+        for p in (50, 90, 99, 99.9):
+            summary[f"latency_p{p}_ms"] = float(np.percentile(latencies_ms, p))
+        summary["latency_max_ms"] = float(latencies_ms.max())
+    return summary
+
+
+def compare(result, baseline, max_regression):
+    """
+    Returns:
+        List of regressions beyond `max_regression` (relative) against a previous result file.
+    """
+    regressions = []
+    old, new = baseline["results"], result["results"]
+    if new["throughput_rps"] < old["throughput_rps"] * (1 - max_regression):
+        regressions.append(f"throughput {old['throughput_rps']:.0f} -> {new['throughput_rps']:.0f} req/s")
+    for key in ("latency_p50_ms", "latency_p99_ms"):
+        if key in old and key in new and new[key] > old[key] * (1 + max_regression):
+            regressions.append(f"{key} {old[key]:.2f} -> {new[key]:.2f}")
+    if new["error_rate"] > old["error_rate"] + 0.001:
+        regressions.append(f"error rate {old['error_rate']:.4f} -> {new['error_rate']:.4f}")
+    if old.get("rss_peak_bytes") and new.get("rss_peak_bytes") and \
+            new["rss_peak_bytes"] > old["rss_peak_bytes"] * (1 + max_regression):
+        regressions.append(f"peak RSS {old['rss_peak_bytes'] / 2**20:.0f} -> {new['rss_peak_bytes'] / 2**20:.0f} MiB")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--server", choices=sorted(SERVER_COMMANDS), default="gunicorn", help="Server to start from the local sources")
+    parser.add_argument("--image", type=str, default=None, help="Docker image to test instead of the local sources")
+    parser.add_argument("--image-command", type=str, default="gunicorn --chdir /app/src -c gunicorn.conf.py wsgi:app",
+                        help="Command to start the server in the image")
+    parser.add_argument("--env", action="append", default=[], help="KEY=VALUE environment for the server, repeatable")
+    parser.add_argument("--concurrency", type=int, default=16, help="Concurrent clients")
+    parser.add_argument("--duration", type=float, default=30, help="Seconds to drive load")
+    parser.add_argument("--warmup", type=float, default=3, help="Seconds of load before measuring")
+    parser.add_argument("--batch-ratio", type=float, default=0.0, help="Fraction of requests sending a batch")
+    parser.add_argument("--batch-size", type=int, default=64, help="Rows per batch request")
+    parser.add_argument("--startup-timeout", type=float, default=60)
+    parser.add_argument("--label", type=str, default=None, help="Name of the version under test, stored in the output")
+    parser.add_argument("--output", type=str, default="load-test-results.json")
+    parser.add_argument("--compare", type=str, default=None, help="Previous output file to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.1, help="Tolerated relative regression for --compare")
+    args = parser.parse_args()
+    env = dict(item.split('=', 1) for item in args.env)
+
+    with tempfile.TemporaryDirectory() as model_dir:
+        model_path, X = train_model(model_dir)
+        port = free_port()
+        if args.image:
+            server = DockerServer(args.image, model_path, port, env, args.image_command)
+        else:
+            server = LocalServer(args.server, model_path, port, env)
+        try:
+            wait_ready(port, args.startup_timeout)
+            rss_idle = server.rss_bytes()
+            if args.warmup > 0:
+                drive(port, X, args.concurrency, args.warmup, args.batch_ratio, args.batch_size)
+
+            rss_samples = []
+            sampling = threading.Event()
+
+            def sample_rss():
+                while not sampling.wait(0.5):
+                    rss_samples.append(server.rss_bytes())
+
+            sampler = threading.Thread(target=sample_rss, daemon=True)
+            sampler.start()
+            summary = summarize(*drive(port, X, args.concurrency, args.duration, args.batch_ratio, args.batch_size))
+            sampling.set()
+            sampler.join()
+        finally:
+            server.stop()
+
+    rss_samples = [rss for rss in rss_samples if rss]
+    summary["rss_idle_bytes"] = rss_idle
+    summary["rss_peak_bytes"] = max(rss_samples) if rss_samples else None
+    result = {
+        "label": args.label,
+        "timestamp": time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        "config": vars(args),
+        "results": summary,
+    }
+    with open(args.output, 'w') as fd:
+        json.dump(result, fd, indent=2)
+    print(json.dumps(summary, indent=2))
+
+    if args.compare:
+        with open(args.compare) as fd:
+            regressions = compare(result, json.load(fd), args.max_regression)
+        for regression in regressions:
+            print(f"Regression: {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+Compares the per-request prediction path of `hello-aicore-serve/main.py`
+with micro-batching, for the same number of concurrent callers.
+
+    python micro_batching.py --clients 32 --requests 500 --max-batch-size 32 --max-wait-ms 2
+
+Reports p50/p99 latency (milliseconds) and throughput (predictions/second).
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+
+import numpy as np
+from sklearn.tree import DecisionTreeRegressor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'hello-aicore-serve'))
+from batching import MicroBatcher
+
+N_FEATURES = 8 # MedInc ... Longitude
+
+
+def train_model(n_rows=20000, max_depth=8, seed=0):
+    rng = np.random.default_rng(seed)
+    X = rng.random((n_rows, N_FEATURES))
+    y = X @ rng.random(N_FEATURES) + rng.normal(scale=0.1, size=n_rows)
+    return DecisionTreeRegressor(max_depth=max_depth).fit(X, y)
+
+
+def run(predict, clients, requests_per_client, seed=0):
+    rng = np.random.default_rng(seed)
+    rows = rng.random((clients, requests_per_client, 1, N_FEATURES))
+    latencies = [None] * clients
+    barrier = threading.Barrier(clients + 1)
+
+    def client(i):
+        timings = np.empty(requests_per_client)
+        barrier.wait()
+        for j in range(requests_per_client):
+            start = time.perf_counter()
+            predict(rows[i, j])
+            timings[j] = time.perf_counter() - start
+        latencies[i] = timings
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    latencies = np.concatenate(latencies) * 1000.
+    return {
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p99_ms": float(np.percentile(latencies, 99)),
+        "throughput_per_s": len(latencies) / elapsed,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", type=int, default=32, help="Concurrent callers")
+    parser.add_argument("--requests", type=int, default=500, help="Requests per caller")
+    parser.add_argument("--max-batch-size", type=int, default=32)
+    parser.add_argument("--max-wait-ms", type=float, default=2.0)
+    parser.add_argument("--output", type=str, default=None, help="Write the results as JSON to this file")
+    args = parser.parse_args()
+
+    model = train_model()
+    batcher = MicroBatcher(model.predict, max_batch_size=args.max_batch_size, max_wait_ms=args.max_wait_ms)
+    results = {
+        "per_request": run(model.predict, args.clients, args.requests),
+        "micro_batching": run(batcher.predict, args.clients, args.requests),
+    }
+
+    print(f"{'mode':<16}{'p50 (ms)':>12}{'p99 (ms)':>12}{'req/s':>12}")
+    for mode, result in results.items():
+        print(f"{mode:<16}{result['p50_ms']:>12.3f}{result['p99_ms']:>12.3f}{result['throughput_per_s']:>12.0f}")
+    if args.output:
+        with open(args.output, 'w') as fd:
+            json.dump({"config": vars(args), "results": results}, fd, indent=2)
+
+
+if __name__ == "__main__":
+    main()
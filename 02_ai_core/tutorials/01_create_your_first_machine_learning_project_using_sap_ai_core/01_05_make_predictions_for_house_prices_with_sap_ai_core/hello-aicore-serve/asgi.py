@@ -0,0 +1,167 @@
+"""
+ASGI variant of the house price server, with the same `/v2/greet` and
+`/v2/predict` contract as main.py:
+
+    python /app/src/asgi.py
+
+Request bodies are received on the event loop, decoding and `model.predict`
+run on a bounded pool (PREDICT_EXECUTOR=thread|process, PREDICT_WORKERS).
+At most MAX_IN_FLIGHT predictions are accepted at a time, further requests
+are answered with 429 instead of being queued.
+
+On SIGTERM the server reports not ready and refuses new predictions, keeps
+running for DRAIN_DELAY seconds while KServe takes it out of the routing,
+then waits for the requests in flight before stopping.
+"""
+import os
+import asyncio
+import threading
+import contextlib
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+import uvicorn
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, PlainTextResponse, Response
+from starlette.routing import Route
+
+import main
+import formats
+import metrics
+
+PREDICT_EXECUTOR = os.getenv('PREDICT_EXECUTOR', 'thread')
+PREDICT_WORKERS = int(os.getenv('PREDICT_WORKERS', '4'))
+MAX_IN_FLIGHT = int(os.getenv('MAX_IN_FLIGHT', '64'))
+DRAIN_DELAY = float(os.getenv('DRAIN_DELAY', '5'))
+DRAIN_TIMEOUT = float(os.getenv('DRAIN_TIMEOUT', '30'))
+
+
+class State(object):
+    ready = False
+    draining = False
+    in_flight = 0
+    executor = None
+
+
+state = State()
+
+
+def decode_and_predict(content_type, body):
+    """
+    Runs on the prediction pool, so neither decoding nor predicting blocks the event loop
+    """
+    with metrics.stage('parse'):
+        media_type, payload = formats.parse(content_type, body)
+    with metrics.stage('convert'):
+        features, is_single_record = formats.to_matrix(media_type, payload)
+    with metrics.stage('predict'):
+        return main.predict_matrix(features), is_single_record
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    loop = asyncio.get_running_loop()
+    if PREDICT_EXECUTOR == 'process':
+        # Every pool process loads its own model
+        state.executor = ProcessPoolExecutor(max_workers=PREDICT_WORKERS, initializer=main.init)
+    else:
+        state.executor = ThreadPoolExecutor(max_workers=PREDICT_WORKERS, thread_name_prefix='predict')
+    # Load the model else crash, deployment will not start
+    await loop.run_in_executor(state.executor, main.init)
+    state.ready = True
+    yield
+    state.ready = False
+    state.executor.shutdown(wait=True)
+
+
+async def status(request):
+    if not state.ready or state.draining:
+        return PlainTextResponse("ASGI Code: Model was not loaded.", status_code=503)
+    loaded = main.loader.get()
+    if loaded is None:
+        # The model lives in the pool processes (PREDICT_EXECUTOR=process)
+        return PlainTextResponse("Model is loaded.")
+    return PlainTextResponse(f"Model is loaded. Version {loaded.version}, loaded in {loaded.load_time * 1000:.1f} ms.")
+
+
+async def cache_stats(request):
+    # With PREDICT_EXECUTOR=process every pool process has its own cache, which is not reported here
+    if main.cache is None:
+        return JSONResponse({"enabled": False})
+    return JSONResponse({"enabled": True, **main.cache.stats()})
+
+
+async def prometheus_metrics(request):
+    # With PREDICT_EXECUTOR=process the parse/convert/predict stages are recorded in the pool processes
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+async def predict(request):
+    """
+    Perform an inference on the model, see main.predict for the accepted formats
+    """
+    if metrics.profiler is not None:
+        metrics.profiler.ensure_started()
+    response = await predict_request(request)
+    metrics.REQUESTS.inc(code=response.status_code)
+    return response
+
+
+async def predict_request(request):
+    if state.draining:
+        return PlainTextResponse("Server is shutting down.", status_code=503)
+    if state.in_flight >= MAX_IN_FLIGHT:
+        return PlainTextResponse("Too many requests in flight.", status_code=429, headers={"Retry-After": "1"})
+    state.in_flight += 1
+    metrics.IN_FLIGHT.inc()
+    try:
+        with metrics.stage('read'):
+            body = await request.body()
+        loop = asyncio.get_running_loop()
+        try:
+            prediction, is_single_record = await loop.run_in_executor(
+                state.executor, decode_and_predict, request.headers.get('content-type'), body)
+        except (KeyError, ValueError, TypeError) as error:
+            return PlainTextResponse(f"Invalid request: {error!r}", status_code=400)
+        with metrics.stage('encode'):
+            if is_single_record:
+                return PlainTextResponse(str(prediction))
+            body, media_type = formats.encode(prediction, request.headers.get('accept'))
+            return Response(body, media_type=media_type)
+    finally:
+        state.in_flight -= 1
+        metrics.IN_FLIGHT.dec()
+
+
+app = Starlette(
+    routes=[
+        Route("/v2/greet", status, methods=["GET"]),
+        Route("/v2/predict", predict, methods=["POST"]),
+        Route("/v2/cache/stats", cache_stats, methods=["GET"]),
+        Route("/metrics", prometheus_metrics, methods=["GET"]),
+    ],
+    lifespan=lifespan,
+)
+
+
+class DrainingServer(uvicorn.Server):
+    """
+    Delays uvicorn's shutdown on SIGTERM/SIGINT until the pod stopped receiving traffic
+    """
+
+    def handle_exit(self, sig, frame):
+        if state.draining:
+            return super().handle_exit(sig, frame)
+        state.draining = True
+        threading.Timer(DRAIN_DELAY, super().handle_exit, (sig, frame)).start()
+
+
+if __name__ == "__main__":
+    print("Serving Initializing")
+    config = uvicorn.Config(
+        app,
+        host="0.0.0.0",
+        port=int(os.getenv('PORT', '9001')),
+        timeout_graceful_shutdown=int(DRAIN_TIMEOUT), # wait at most this long for requests in flight
+    )
+    print("Serving Started")
+    DrainingServer(config).run()
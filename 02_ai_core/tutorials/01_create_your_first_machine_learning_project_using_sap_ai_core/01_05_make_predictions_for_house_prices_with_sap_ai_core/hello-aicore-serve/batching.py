@@ -0,0 +1,110 @@
+import os
+import queue
+import threading
+import time
+
+import numpy as np
+
+
+class _Pending(object):
+    """
+    One queued request: its feature rows and, once predicted, its result
+    """
+    __slots__ = ("features", "result", "error", "done")
+
+    def __init__(self, features):
+        self.features = features
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class MicroBatcher(object):
+    """
+    Merges the feature rows of concurrent requests into one matrix, so the
+    model is called once per batch instead of once per request.
+
+    A batch is closed when it holds `max_batch_size` rows or when its first
+    request has waited `max_wait_ms` milliseconds, whichever comes first.
+    Requests arriving while a batch is predicted are queued for the next one.
+
+    > batcher = MicroBatcher(lambda X: model.predict(X), max_batch_size=32, max_wait_ms=5)
+    > prediction = batcher.predict(np.array([[8.3, 41.0, 6.9, 1.0, 322.0, 2.5, 37.8, -122.2]]))
+
+    Batching only helps when requests are served concurrently, i.e. with a
+    threaded server (`app.run(threaded=True)`, `gunicorn --threads N`).
+    """
+
+    def __init__(self, predict_fn, max_batch_size=32, max_wait_ms=5.0):
+        self.predict_fn = predict_fn
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.
+        self._lock = threading.Lock()
+        self._queue = None
+        self._pid = None
+
+    def _ensure_worker(self):
+        # The worker thread is started lazily, and again in every forked
+        # process, because threads do not survive a fork
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self._queue = queue.Queue()
+                worker = threading.Thread(target=self._run, name="micro-batcher", daemon=True)
+                worker.start()
+                self._pid = os.getpid()
+
+    def predict(self, features):
+        """
+        Queue a 2-D feature matrix and block until its rows were predicted
+
+        Returns:
+            Array with one prediction per row of `features`.
+        """
+        self._ensure_worker()
+        pending = _Pending(features)
+        self._queue.put(pending)
+        pending.done.wait()
+        if pending.error is not None:
+            raise pending.error
+        return pending.result
+
+    def _collect(self):
+        # Block for the first request, then fill the batch until it is full or the wait expired
+        batch = [self._queue.get()]
+        rows = len(batch[0].features)
+        deadline = time.monotonic() + self.max_wait
+        while rows < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            try:
+                if timeout > 0:
+                    pending = self._queue.get(timeout=timeout)
+                else:
+                    pending = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            batch.append(pending)
+            rows += len(pending.features)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            try:
+                if len(batch) == 1:
+                    predictions = self.predict_fn(batch[0].features)
+                else:
+                    predictions = self.predict_fn(np.concatenate([p.features for p in batch]))
+            except Exception as error:
+                for pending in batch:
+                    pending.error = error
+                    pending.done.set()
+                continue
+            # Fan the predictions back out to the waiting requests
+            offset = 0
+            for pending in batch:
+                size = len(pending.features)
+                pending.result = predictions[offset:offset + size]
+                offset += size
+                pending.done.set()
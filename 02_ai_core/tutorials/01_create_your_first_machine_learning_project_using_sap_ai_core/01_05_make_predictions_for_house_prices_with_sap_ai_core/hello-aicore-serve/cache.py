@@ -0,0 +1,127 @@
+import sys
+import time
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+class PredictionCache(object):
+    """
+    In-process LRU cache of predictions, keyed on the float feature tuple of a row.
+
+    Entries are evicted least recently used first once the cache holds more than
+    `max_entries` entries or about `max_bytes` bytes, and expire `ttl` seconds
+    after they were stored (never if `ttl` is 0).
+
+    All entries are dropped when `version_fn()` changes, which is checked at most
+    every `check_interval` seconds; pass a function returning the model version
+    (e.g. the model file's modification time) so a new model is never answered
+    with predictions of the old one.
+    """
+
+    def __init__(self, max_entries=100000, max_bytes=64 * 2**20, ttl=300.0, version_fn=None, check_interval=1.0):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.version_fn = version_fn
+        self.check_interval = check_interval
+        self._entries = OrderedDict() # key -> (prediction, expiry, size)
+        self._lock = threading.Lock()
+        self._bytes = 0
+        self._version = version_fn() if version_fn is not None else None
+        self._next_check = time.monotonic() + check_interval
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def keys(features):
+        # `+ 0.0` turns -0.0 into 0.0, so both hit the same entry
+        return [tuple(row) for row in (np.asarray(features, dtype=np.float64) + 0.0).tolist()]
+
+    @staticmethod
+    def _entry_size(key):
+        # Tuple plus its floats, the cached float and the dict/tuple bookkeeping
+        return sys.getsizeof(key) + 24 * len(key) + 24 + 120
+
+    def _check_version(self, now):
+        if self.version_fn is None or now < self._next_check:
+            return
+        self._next_check = now + self.check_interval
+        version = self.version_fn()
+        if version != self._version:
+            self._version = version
+            self._entries.clear()
+            self._bytes = 0
+            self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def predict(self, features, predict_fn):
+        """
+        Answer the rows of `features` from the cache, and the others with one `predict_fn` call
+        """
+        keys = self.keys(features)
+        predictions = np.empty(len(keys))
+        missing = []
+        with self._lock:
+            now = time.monotonic()
+            self._check_version(now)
+            for i, key in enumerate(keys):
+                entry = self._entries.get(key)
+                if entry is not None and entry[1] < now:
+                    self._remove(key)
+                    self.expirations += 1
+                    entry = None
+                if entry is None:
+                    missing.append(i)
+                    continue
+                self._entries.move_to_end(key)
+                predictions[i] = entry[0]
+            self.hits += len(keys) - len(missing)
+            self.misses += len(missing)
+            version = self._version
+        if not missing:
+            return predictions
+
+        predictions[missing] = predict_fn(features[missing])
+
+        with self._lock:
+            if version != self._version:
+                # The model changed while predicting, these predictions may be stale
+                return predictions
+            expiry = time.monotonic() + self.ttl if self.ttl > 0 else float('inf')
+            for i in missing:
+                key = keys[i]
+                if key in self._entries:
+                    self._remove(key)
+                size = self._entry_size(key)
+                self._entries[key] = (float(predictions[i]), expiry, size)
+                self._bytes += size
+            while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+        return predictions
+
+    def _remove(self, key):
+        self._bytes -= self._entries.pop(key)[2]
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+            }
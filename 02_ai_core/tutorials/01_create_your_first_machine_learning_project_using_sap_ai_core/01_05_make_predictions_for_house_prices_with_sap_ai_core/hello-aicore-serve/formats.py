@@ -0,0 +1,108 @@
+"""
+Request and response formats of the `/v2/predict` endpoint.
+
+The format is chosen from the `Content-Type` of the request:
+
+    application/json                     one record      {"MedInc": 8.3, ..., "Longitude": -122.2}
+                                         records         [{"MedInc": 8.3, ...}, {"MedInc": 7.2, ...}]
+                                         columns         {"MedInc": [8.3, 7.2], ..., "Longitude": [-122.2, -122.2]}
+                                         rows            [[8.3, 41.0, ..., -122.2], [7.2, 21.0, ..., -122.2]]
+    application/octet-stream             raw little-endian float64 buffer, row-major, 8 values per row in FEATURES order
+    application/vnd.apache.arrow.stream  Arrow IPC stream with (at least) the FEATURES columns
+
+Every format is decoded straight into a float64 matrix with one row per observation.
+"""
+import json
+import operator
+import itertools
+
+import numpy as np
+
+FEATURES = ['MedInc', 'HouseAge', 'AveRooms', 'AveBedrms', 'Population', 'AveOccup', 'Latitude', 'Longitude']
+
+JSON = 'application/json'
+BINARY = 'application/octet-stream'
+ARROW = 'application/vnd.apache.arrow.stream'
+
+_get_features = operator.itemgetter(*FEATURES)
+
+
+def decode_json(payload):
+    """
+    Returns:
+        (matrix, is_single_record), the latter to keep the response of one plain record unchanged.
+    """
+    if isinstance(payload, dict):
+        if not isinstance(payload[FEATURES[0]], (list, tuple)):
+            return np.array([_get_features(payload)], dtype=np.float64), True
+        # Column-oriented: one array per feature
+        return np.column_stack([np.asarray(payload[f], dtype=np.float64) for f in FEATURES]), False
+    if isinstance(payload, list):
+        if len(payload) == 0:
+            return np.empty((0, len(FEATURES))), False
+        if isinstance(payload[0], dict):
+            values = itertools.chain.from_iterable(map(_get_features, payload))
+            matrix = np.fromiter(values, dtype=np.float64, count=len(payload) * len(FEATURES))
+            return matrix.reshape(len(payload), len(FEATURES)), False
+        matrix = np.asarray(payload, dtype=np.float64)
+        if matrix.ndim != 2 or matrix.shape[1] != len(FEATURES):
+            raise ValueError(f"Expected rows of {len(FEATURES)} values, got shape {matrix.shape}")
+        return matrix, False
+    raise ValueError("Expected a JSON object or array")
+
+
+def decode_binary(data):
+    if len(data) % (8 * len(FEATURES)) != 0:
+        raise ValueError(f"Buffer size must be a multiple of {8 * len(FEATURES)} bytes")
+    return np.frombuffer(data, dtype='<f8').reshape(-1, len(FEATURES))
+
+
+def decode_arrow(data):
+    import pyarrow as pa # only needed for Arrow requests
+    table = pa.ipc.open_stream(data).read_all().select(FEATURES)
+    return np.column_stack([table.column(f).to_numpy().astype(np.float64, copy=False) for f in FEATURES])
+
+
+def parse(content_type, data):
+    """
+    Parse a request body, without building the feature matrix yet
+
+    Returns:
+        (media type, parsed JSON or the raw bytes)
+    """
+    media_type = (content_type or JSON).split(';')[0].strip().lower()
+    if media_type in (BINARY, ARROW):
+        return media_type, data
+    return JSON, json.loads(data)
+
+
+def to_matrix(media_type, payload):
+    """
+    Returns:
+        (matrix, is_single_record)
+    """
+    if media_type == BINARY:
+        return decode_binary(payload), False
+    if media_type == ARROW:
+        return decode_arrow(payload), False
+    return decode_json(payload)
+
+
+def decode(content_type, data):
+    """
+    Decode a request body
+
+    Returns:
+        (matrix, is_single_record)
+    """
+    return to_matrix(*parse(content_type, data))
+
+
+def encode(predictions, accept):
+    """
+    Returns:
+        (body, mimetype), a float64 vector if the client accepts binary, else a JSON array.
+    """
+    if accept and BINARY in accept:
+        return np.ascontiguousarray(predictions, dtype='<f8').tobytes(), BINARY
+    return json.dumps(predictions.tolist()), JSON
@@ -0,0 +1,17 @@
+# gunicorn settings for `gunicorn -c gunicorn.conf.py wsgi:app`, see wsgi.py
+import os
+
+
+def cpu_count():
+    # Cores this container may run on, which can be fewer than the host has
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+bind = f"0.0.0.0:{os.getenv('PORT', '9001')}"
+workers = int(os.getenv('WORKERS') or cpu_count())
+threads = int(os.getenv('THREADS', '1')) # > 1 lets the micro-batcher (BATCH_MAX_SIZE) merge requests of one worker
+timeout = int(os.getenv('WORKER_TIMEOUT', '30'))
+# Load the model in the master before forking, see wsgi.py
+preload_app = True
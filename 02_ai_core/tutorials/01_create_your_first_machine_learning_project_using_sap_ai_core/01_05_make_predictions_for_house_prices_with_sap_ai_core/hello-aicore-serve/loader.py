@@ -0,0 +1,139 @@
+"""
+Loads the model from `/mnt/models` and hot-swaps it when a new version lands there.
+
+Two artifact formats are understood, the first one found is used:
+
+    model.joblib   written with `joblib.dump(model, 'model.joblib')` (uncompressed), loaded with
+                   `mmap_mode='r'`: numpy arrays inside the model are mapped from the file instead
+                   of read into the heap, so loading is fast and the pages are shared by all workers.
+                   Estimators that copy their arrays on unpickling (e.g. the node arrays of sklearn
+                   trees) still hold their own copy.
+    model.pkl      plain pickle, read completely into the heap.
+"""
+import os
+import time
+import pickle
+import datetime
+import threading
+import traceback
+
+import numpy as np
+
+ARTIFACTS = ('model.joblib', 'model.pkl')
+
+
+class LoadedModel(object):
+    """
+    A model together with where it came from; replaced as a whole on reload
+    """
+
+    def __init__(self, model, path, signature, version, load_time):
+        self.model = model
+        self.path = path
+        self.signature = signature
+        self.version = version
+        self.load_time = load_time
+
+
+def file_signature(path):
+    """
+    Changes whenever the file is replaced or rewritten, None if it does not exist
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+
+class ModelLoader(object):
+    """
+    Holds the active model and polls for new versions in a background thread.
+
+    Requests read `loader.get()` once and use that model throughout, so a reload
+    never changes the model in the middle of a request. The new model is loaded
+    and warmed up next to the old one, then swapped in with a single assignment.
+
+    A changed file is only loaded once it kept the same size and modification
+    time for one `poll_interval`, so half-copied files are not picked up.
+    """
+
+    def __init__(self, model_dir='/mnt/models', model_path=None, poll_interval=5.0, n_features=8, mmap_mode='r'):
+        self.model_dir = model_dir
+        self.model_path = model_path
+        self.poll_interval = poll_interval
+        self.n_features = n_features
+        self.mmap_mode = mmap_mode
+        self.current = None
+        self.generation = 0 # incremented on every swap
+        self._lock = threading.Lock()
+        self._watch_pid = None
+
+    def artifact_path(self):
+        if self.model_path:
+            return self.model_path
+        for name in ARTIFACTS:
+            path = os.path.join(self.model_dir, name)
+            if os.path.exists(path):
+                return path
+        return os.path.join(self.model_dir, ARTIFACTS[-1])
+
+    def _read(self, path):
+        if path.endswith('.joblib'):
+            import joblib
+            return joblib.load(path, mmap_mode=self.mmap_mode)
+        with open(path, 'rb') as fd:
+            return pickle.load(fd)
+
+    def load(self):
+        """
+        Load, warm up and activate the current artifact, raises if it cannot be loaded
+        """
+        path = self.artifact_path()
+        signature = file_signature(path)
+        start = time.perf_counter()
+        model = self._read(path)
+        # Warm-up: the first predict call pays for lazy imports and input validation setup
+        model.predict(np.zeros((1, self.n_features)))
+        load_time = time.perf_counter() - start
+        version = datetime.datetime.fromtimestamp(signature[2] / 1e9).isoformat() if signature else 'unknown'
+        with self._lock:
+            self.current = LoadedModel(model, path, signature, version, load_time)
+            self.generation += 1
+        print(f"Loaded {path} (version {version}) in {load_time * 1000:.1f} ms")
+        return self.current
+
+    def get(self):
+        """
+        The active model; also starts the watcher in this process (threads do not survive a fork)
+        """
+        if self._watch_pid != os.getpid() and self.poll_interval > 0:
+            with self._lock:
+                if self._watch_pid != os.getpid():
+                    threading.Thread(target=self._watch, name="model-watcher", daemon=True).start()
+                    self._watch_pid = os.getpid()
+        return self.current
+
+    def _watch(self):
+        pending = None
+        failed = None
+        while True:
+            time.sleep(self.poll_interval)
+            current = self.current
+            path = self.artifact_path()
+            signature = file_signature(path)
+            if signature is None or (path, signature) == failed or (
+                    current is not None and (path, signature) == (current.path, current.signature)):
+                pending = None
+                continue
+            if pending != (path, signature):
+                pending = (path, signature) # wait one more interval for the file to settle
+                continue
+            try:
+                self.load()
+            except Exception:
+                # Keep serving the previous model until the file changes again
+                print(f"Error: could not load {path}, keeping the active model")
+                traceback.print_exc()
+                failed = (path, signature)
+            pending = None
@@ -1,30 +1,115 @@
 import os
-import pickle
 import numpy as np
-from flask import Flask
+from flask import Flask, Response, jsonify
 from flask import request as call_request
 
+import formats
+import metrics
+from batching import MicroBatcher
+from cache import PredictionCache
+from loader import ModelLoader
+
+MODEL_DIR = '/mnt/models' # All the model files will be read from /mnt/models, model.joblib (memory-mapped) or model.pkl
+MODEL_PATH = os.getenv('MODEL_PATH') # optional, a single model file to serve instead
+MODEL_POLL_INTERVAL = float(os.getenv('MODEL_POLL_INTERVAL', '5')) # seconds between checks for a new model, 0 to disable
+PORT = int(os.getenv('PORT', '9001'))
+DEBUG = os.getenv('DEBUG', '1') == '1' # Flask debug mode and its reloader, DEBUG=0 when run by a harness (benchmarks/load_test.py)
+
+# Micro-batching merges concurrent requests into one `model.predict` call, disabled when BATCH_MAX_SIZE is 1
+BATCH_MAX_SIZE = int(os.getenv('BATCH_MAX_SIZE', '1'))
+BATCH_MAX_WAIT_MS = float(os.getenv('BATCH_MAX_WAIT_MS', '5'))
+
+# Prediction cache in front of the model, disabled when CACHE_MAX_ENTRIES is 0
+CACHE_MAX_ENTRIES = int(os.getenv('CACHE_MAX_ENTRIES', '0'))
+CACHE_MAX_BYTES = int(os.getenv('CACHE_MAX_BYTES', str(64 * 2**20)))
+CACHE_TTL = float(os.getenv('CACHE_TTL', '300')) # seconds, 0 to never expire
+
 # Creates Flask serving engine
 app = Flask(__name__)
 
-model = None
+# Holds the active model and swaps in new versions found under MODEL_DIR
+loader = ModelLoader(MODEL_DIR, model_path=MODEL_PATH, poll_interval=MODEL_POLL_INTERVAL, n_features=len(formats.FEATURES))
+
+batcher = None
+if BATCH_MAX_SIZE > 1:
+    batcher = MicroBatcher(lambda X: model_predict(X), max_batch_size=BATCH_MAX_SIZE, max_wait_ms=BATCH_MAX_WAIT_MS)
+
+cache = None
+if CACHE_MAX_ENTRIES > 0:
+    # Dropped whenever the loader swaps in another model
+    cache = PredictionCache(max_entries=CACHE_MAX_ENTRIES, max_bytes=CACHE_MAX_BYTES, ttl=CACHE_TTL,
+                            version_fn=lambda: loader.generation, check_interval=0)
 
 @app.before_first_request
 def init():
     """
     Load model else crash, deployment will not start
+
+    Called once in the gunicorn master when serving with wsgi.py, so the workers
+    inherit the loaded model instead of unpickling it each.
     """
-    global model
-    model = pickle.load(open ('/mnt/models/model.pkl','rb')) # All the model files will be read from /mnt/models
+    if loader.current is None:
+        loader.load() # also warms the model up
     return None
 
 @app.route("/v2/greet", methods=["GET"])
 def status():
-    global model
-    if model is None:
-        return "Flask Code: Model was not loaded."
+    loaded = loader.get()
+    if loaded is None:
+        return "Flask Code: Model was not loaded.", 503
     else:
-        return "Model is loaded."
+        return f"Model is loaded. Version {loaded.version}, loaded in {loaded.load_time * 1000:.1f} ms."
+
+@app.route("/v2/cache/stats", methods=["GET"])
+def cache_stats():
+    """
+    Hit/miss/eviction counters of the prediction cache (of this worker process)
+    """
+    if cache is None:
+        return jsonify({"enabled": False})
+    return jsonify({"enabled": True, **cache.stats()})
+
+@app.route("/metrics", methods=["GET"])
+def prometheus_metrics():
+    """
+    Request metrics of this worker process in Prometheus text format
+    """
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+@app.route("/v2/profile", methods=["GET"])
+def profile():
+    """
+    Folded stacks sampled by the profiler (PROFILE_INTERVAL_MS), e.g. `curl .../v2/profile | flamegraph.pl > flame.svg`
+    """
+    if metrics.profiler is None:
+        return "Profiler is disabled, set PROFILE_INTERVAL_MS.", 404
+    return Response(metrics.profiler.folded(), mimetype="text/plain")
+
+def model_predict(features):
+    """
+    The actual `model.predict` call, of one request or of a micro-batch
+    """
+    metrics.BATCH_SIZE.observe(len(features))
+    with metrics.stage('model'):
+        return loader.get().model.predict(features)
+
+def predict_matrix(features):
+    """
+    Predict a 2-D feature matrix, answering repeated rows from the cache if enabled
+    """
+    if len(features) == 0:
+        return np.empty(0)
+    if cache is not None:
+        return cache.predict(features, predict_uncached)
+    return predict_uncached(features)
+
+def predict_uncached(features):
+    """
+    Predict through the micro-batcher when the matrix is small enough to share a batch
+    """
+    if batcher is not None and len(features) < BATCH_MAX_SIZE:
+        return batcher.predict(features) # waits for the batch shared with concurrent requests
+    return model_predict(features)
 
 # You may customize the endpoint, but must have the prefix `/v<number>`
 @app.route("/v2/predict", methods=["POST"])
@@ -32,33 +117,53 @@ def predict():
     """
     Perform an inference on the model created in initialize
 
+    Accepts one record, or many as records, columns, Arrow IPC or raw float64 buffer (see formats.py).
+
+    Returns:
+        String value price for one record, otherwise a JSON array (or float64 vector) of prices.
+    """
+    if metrics.profiler is not None:
+        metrics.profiler.ensure_started()
+    metrics.IN_FLIGHT.inc()
+    try:
+        status, response = predict_request()
+    except Exception:
+        metrics.REQUESTS.inc(code=500)
+        raise
+    finally:
+        metrics.IN_FLIGHT.dec()
+    metrics.REQUESTS.inc(code=status)
+    return response, status
+
+def predict_request():
+    """
     Returns:
-        String value price.
+        (status code, response), timing every stage of the request
     """
-    global model
     #
-    query = dict(call_request.json)
-    input_features = [ # list of values from request call
-        query['MedInc'],
-        query['HouseAge'],
-        query['AveRooms'],
-        query['AveBedrms'],
-        query['Population'],
-        query['AveOccup'],
-        query['Latitude'],
-        query['Longitude'],
-    ]
+    with metrics.stage('read'):
+        data = call_request.get_data()
+    try:
+        with metrics.stage('parse'):
+            media_type, payload = formats.parse(call_request.content_type, data)
+        with metrics.stage('convert'):
+            features, is_single_record = formats.to_matrix(media_type, payload)
+    except (KeyError, ValueError, TypeError) as error:
+        return 400, f"Invalid request: {error!r}"
     # Prediction
-    prediction = model.predict(
-        np.array([list(map(float, input_features)),]) # (trailing comma) <,> to make batch with 1 observation
-    )
-    output = str(prediction)
-    # Response
-    return output
+    with metrics.stage('predict'):
+        prediction = predict_matrix(features)
+    with metrics.stage('encode'):
+        if is_single_record:
+            output = str(prediction)
+            # Response
+            return 200, output
+        body, mimetype = formats.encode(prediction, call_request.headers.get("Accept"))
+        return 200, Response(body, mimetype=mimetype)
 
 if __name__ == "__main__":
     print("Serving Initializing")
     init()
     print(f'{os.environ["greetingmessage"]}')
     print("Serving Started")
-    app.run(host="0.0.0.0", debug=True, port=9001)
+    app.run(host="0.0.0.0", debug=DEBUG, use_reloader=DEBUG, port=PORT)
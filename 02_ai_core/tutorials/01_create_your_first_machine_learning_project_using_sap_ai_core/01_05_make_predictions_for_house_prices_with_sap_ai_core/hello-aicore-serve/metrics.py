@@ -0,0 +1,225 @@
+"""
+Request metrics in Prometheus text format, and an opt-in sampling profiler.
+
+    METRICS_ENABLED=0        replaces every metric with a no-op (default 1)
+    PROFILE_INTERVAL_MS=10   samples the stacks of all threads every 10 ms (default 0, off)
+    PROFILE_FILTER=predict   keeps only stacks with a frame of that name, empty to keep all (default predict)
+
+Metrics and profiles are kept per process: with several gunicorn workers,
+every scrape of `/metrics` answers from the worker that received it.
+"""
+import os
+import sys
+import time
+import bisect
+import threading
+import collections
+
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', '1') not in ('0', 'false', 'False')
+PROFILE_INTERVAL_MS = float(os.getenv('PROFILE_INTERVAL_MS', '0'))
+PROFILE_FILTER = os.getenv('PROFILE_FILTER', 'predict')
+
+LATENCY_BUCKETS = (.0001, .00025, .0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1., 2.5, 5., 10.)
+SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 4096, 16384, 65536)
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{k}="{v}"' for k, v in labels) + '}'
+
+
+class Counter(object):
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self._values = collections.defaultdict(float)
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] += amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels(key)} {value}")
+        return lines
+
+
+class Gauge(object):
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount=1):
+        with self._lock:
+            self.value -= amount
+
+    def render(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge", f"{self.name} {self.value}"]
+
+
+class Histogram(object):
+
+    def __init__(self, name, help, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self._series = {} # labels -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    def time(self, **labels):
+        return _Timer(self, labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + ('+Inf',), series):
+                    cumulative += count
+                    lines.append(f"{self.name}_bucket{_labels(key + (('le', bound),))} {cumulative}")
+                lines.append(f"{self.name}_sum{_labels(key)} {series[-1]}")
+                lines.append(f"{self.name}_count{_labels(key)} {cumulative}")
+        return lines
+
+
+class _Timer(object):
+    __slots__ = ("histogram", "labels", "start")
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, type, value, traceback):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+
+
+class _NoOp(object):
+    """
+    Stands in for every metric when METRICS_ENABLED=0
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        return None
+
+    def time(self, **labels):
+        return self
+
+    def inc(self, *args, **labels):
+        return None
+
+    def dec(self, *args, **labels):
+        return None
+
+    def observe(self, *args, **labels):
+        return None
+
+    def render(self):
+        return []
+
+
+_NOOP = _NoOp()
+
+
+def _metric(cls, *args):
+    return cls(*args) if METRICS_ENABLED else _NOOP
+
+
+STAGE_SECONDS = _metric(Histogram, 'predict_stage_seconds', 'Time spent per stage of /v2/predict')
+REQUESTS = _metric(Counter, 'predict_requests_total', 'Requests to /v2/predict by status code')
+IN_FLIGHT = _metric(Gauge, 'predict_in_flight', 'Requests to /v2/predict being processed')
+BATCH_SIZE = _metric(Histogram, 'predict_batch_size', 'Rows per model.predict call', SIZE_BUCKETS)
+
+
+def stage(name):
+    """
+    Context manager timing one stage of a request, e.g. `with metrics.stage('parse'):`
+    """
+    return STAGE_SECONDS.time(stage=name)
+
+
+def render():
+    lines = []
+    for metric in (REQUESTS, IN_FLIGHT, STAGE_SECONDS, BATCH_SIZE):
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+class SamplingProfiler(object):
+    """
+    Samples the Python stacks of all other threads every `interval_ms` and counts
+    them in folded format ("frame;frame;frame count"), the input of flamegraph.pl
+    and speedscope. Only stacks with a frame named `only` are kept, so idle threads
+    waiting for connections do not drown the hot path.
+    """
+
+    def __init__(self, interval_ms, only=''):
+        self.interval = interval_ms / 1000.
+        self.only = only
+        self.samples = collections.Counter()
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def ensure_started(self):
+        # Started lazily, and again in every forked worker
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self.samples = collections.Counter()
+                threading.Thread(target=self._run, name="sampling-profiler", daemon=True).start()
+                self._pid = os.getpid()
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while True:
+            time.sleep(self.interval)
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                keep = not self.only
+                while frame is not None:
+                    code = frame.f_code
+                    keep = keep or code.co_name == self.only
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                if not keep:
+                    continue
+                with self._lock:
+                    self.samples[';'.join(reversed(stack))] += 1
+
+    def folded(self):
+        with self._lock:
+            return '\n'.join(f"{stack} {count}" for stack, count in self.samples.most_common()) + '\n'
+
+
+profiler = SamplingProfiler(PROFILE_INTERVAL_MS, PROFILE_FILTER) if PROFILE_INTERVAL_MS > 0 else None
@@ -0,0 +1,20 @@
+"""
+Production entry point, serves `main.app` with pre-forked gunicorn workers:
+
+    gunicorn --chdir /app/src -c gunicorn.conf.py wsgi:app
+
+With `preload_app` this module is imported once in the gunicorn master, which
+loads and warms up the model before forking. The workers share the model pages
+copy-on-write instead of each holding its own copy.
+"""
+import gc
+
+import main
+
+main.init()
+
+# Move everything allocated so far out of the garbage collector's reach, otherwise
+# collections in the workers touch (and so copy) the pages of the shared model
+gc.freeze()
+
+app = main.app
@@ -0,0 +1,135 @@
+#!/usr/bin/python3
+"""
+Escaping and unescaping of the {{...}} placeholders on generated ServingTemplates with many of them:
+the former regex + str.replace per placeholder against the single pass of escape_placeholders /
+unescape_placeholders, and the time to check and convert a template. Every template is also checked to be
+read the same by the fast loader of the checks and the round trip loader of the conversion.
+
+    python3 benchmark_placeholders.py --placeholders 100 300 1000
+"""
+
+import io
+import re
+import time
+import contextlib
+import argparse
+from collections import Counter
+
+import v1alpha2_to_v1beta1 as st
+
+
+def replace_escape(yamldata):
+    # What yaml_escape_modification did: one str.replace over the whole document per placeholder
+    c = Counter(re.findall(r"(?<!\")(\{\{.*\}\}[a-zA-Z0-9\.:\-_/]*)(?!\")", yamldata))
+    for n in c:
+        if "\\n" in n:
+            continue
+        yamldata = yamldata.replace(n, "\"" + n + "\"")
+    return (yamldata, c)
+
+
+def replace_unescape(yamldata, changes):
+    for n in changes:
+        if "\\n" in n:
+            continue
+        yamldata = yamldata.replace("\"" + n + "\"", n)
+        yamldata = yamldata.replace("'" + n + "'", n)
+    return yamldata
+
+
+def generate_template(placeholders, runtime=False):
+    # runtime: with the fields of a template exported from a cluster, which the conversion removes
+    last_applied = ("    kubectl.kubernetes.io/last-applied-configuration: '{\"spec\":{\"inputs\":{\"parameters\":"
+                    "[{\"name\":\"minReplicas\",\"default\":\"{{inputs.parameters.minReplicas}}\"}]}}}'\n"
+                    if runtime else "")
+    status = "status:\n  message: \"{{inputs.parameters.minReplicas}}\"\n" if runtime else ""
+    env = "".join("                - name: VARIABLE_%d\n"
+                  "                  value: {{inputs.parameters.variable%d}}\n" % (i, i) for i in range(placeholders))
+    parameters = "".join("      - name: variable%d\n        type: string\n" % i for i in range(placeholders))
+    return ("apiVersion: ai.sap.com/v1alpha1\n"
+            "kind: ServingTemplate\n"
+            "metadata:\n"
+            "  name: generated\n"
+            "  annotations:\n"
+            "    scenarios.ai.sap.com/name: generated\n" + last_applied +
+            "  labels:\n"
+            "    scenarios.ai.sap.com/id: generated\n"
+            "spec:\n"
+            "  inputs:\n"
+            "    parameters:\n" + parameters +
+            "  imagePullSecrets:\n"
+            "    - name: some-docker-registry\n"
+            "  template:\n"
+            "    apiVersion: \"serving.kubeflow.org/v1alpha2\"\n"
+            "    metadata:\n"
+            "      labels: |\n"
+            "        ai.sap.com/resourcePlan: \"{{inputs.parameters.resourcePlan}}\"\n"
+            "    spec: |\n"
+            "      default:\n"
+            "        predictor:\n"
+            "          minReplicas: {{inputs.parameters.minReplicas}}\n"
+            "          custom:\n"
+            "            container:\n"
+            "              name: kfserving-container\n"
+            "              image: {{inputs.parameters.dockerRegistry}}/com.sap.example/example-serving:0.0.1\n"
+            "              env:\n" + env + status)
+
+
+def replace_convert(yamldata):
+    # The conversion written as before: str.replace of every escaped placeholder in the whole output
+    escaped, changes = replace_escape(yamldata)
+    template = st.ServingTemplate(yamldata)
+    assert st.check(template) == "v1alpha2"
+    written = st.ryaml.round_trip_dump(st._convert(template, "v1alpha2").data, explicit_start=True, default_flow_style=False)
+    return replace_unescape(written, changes)
+
+
+def timed(fn, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = fn()
+    return result, (time.perf_counter() - start) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--placeholders", type=int, nargs="+", default=[100, 300, 1000])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    for placeholders in args.placeholders:
+        yamldata = generate_template(placeholders)
+        assert st.loaders_agree(yamldata)
+        # Same with a yaml 1.1 directive, which the C parser alone would ignore
+        assert st.loaders_agree("%YAML 1.1\n---\n" + yamldata)
+        (old, changes), old_escape = timed(lambda: replace_escape(yamldata), args.repeat)
+        (new, names), new_escape = timed(lambda: st.escape_placeholders(yamldata), args.repeat)
+        assert old == new
+
+        written = st.ryaml.round_trip_dump(st.ryaml.round_trip_load(new, preserve_quotes=True),
+                                           explicit_start=True, default_flow_style=False)
+        old, old_unescape = timed(lambda: replace_unescape(written, changes), args.repeat)
+        new, new_unescape = timed(lambda: st.unescape_placeholders(written, names), args.repeat)
+        assert old == new
+
+        # The converted templates are written byte for byte as before, also when quoted placeholders are removed
+        with contextlib.redirect_stdout(io.StringIO()):
+            for runtime in (False, True):
+                assert st.convert(generate_template(placeholders, runtime)) == replace_convert(generate_template(placeholders, runtime))
+
+        def convert():
+            template = st.ServingTemplate(yamldata)
+            st.is_serving_template_spec(template.data)
+            st.is_v1beta1_spec(template)
+            st.is_v1alpha2_spec(template)
+            return st.convert_st_v1alpha2_spec(None, template).dump()
+        with contextlib.redirect_stdout(io.StringIO()):
+            _, conversion = timed(convert, 1)
+
+        print("%5d placeholders, %7d bytes: escape %8.2f ms -> %6.2f ms, unescape %8.2f ms -> %6.2f ms, "
+              "check and convert %7.1f ms" % (placeholders, len(yamldata), old_escape * 1e3, new_escape * 1e3,
+                                              old_unescape * 1e3, new_unescape * 1e3, conversion * 1e3))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,68 +1,182 @@
 #!/usr/bin/python3
 
 import os
+import io
 import re
 import sys
+import glob
+import json
+import hashlib
 import argparse
+import tempfile
+import contextlib
+import concurrent.futures
 import ruamel.yaml as ryaml
-from collections import Counter
-
-def yaml_escape_modification(yamldata):
-        
-    p = re.findall(r"(?<!\")(\{\{.*\}\}[a-zA-Z0-9\.:\-_/]*)(?!\")", yamldata) 
-    c = Counter(p)
-    if p is not None:
-        for n, v in c.items():
-            if "\\n" in n:
-                continue
-            pattern = n
-            yamldata = yamldata.replace(pattern, "\"" + n + "\"")
-        return (yamldata, c)
-    return (readyaml, None)
+from collections import Counter, OrderedDict, namedtuple
 
-def get_yaml_from(filename):
+YAML_EXTENSIONS = (".yaml", ".yml")
+DEFAULT_CACHE = os.path.join(os.path.expanduser("~"), ".cache", "v1alpha2_to_v1beta1.json")
+
+# Cached results are dropped when the checks change
+with open(__file__, 'rb') as _fd:
+    SCRIPT_VERSION = hashlib.sha256(_fd.read()).hexdigest()
+
+
+class TemplateError(Exception):
+    """A check failed, code is the error code of the README table (None when the file is not yaml)"""
+    def __init__(self, code, message="Not ServingTemplate"):
+        if code is None:
+            super().__init__("Error: %s" % message)
+        else:
+            super().__init__("Error: [Code %s] %s" % (code, message))
+        self.code = code
+
+
+class UpToDate(Exception):
+    """The ServingTemplate is already a valid v1beta1 spec, there is nothing to do"""
+
+# A {{...}} placeholder (and the path following it) that is not already quoted
+PLACEHOLDER = re.compile(r"(?<!\")(\{\{.*\}\}[a-zA-Z0-9\.:\-_/]*)(?!\")")
+# A quoted placeholder, the quotes of the escaped ones are removed again when writing
+QUOTED_PLACEHOLDER = re.compile(r"([\"'])(\{\{.*?\}\}[a-zA-Z0-9\.:\-_/]*)\1")
+
+
+def escape_placeholders(yamldata):
+    """
+    Quotes the {{...}} placeholders so that the document can be parsed as yaml, in one pass.
+    Returns the escaped document and the set of the placeholders it quoted.
+    """
+    names = set()
+
+    def quote(match):
+        if "\\n" in match.group(1):
+            return match.group(0)
+        names.add(match.group(1))
+        return "\"" + match.group(1) + "\""
+    return (PLACEHOLDER.sub(quote, yamldata), names)
+
+
+def unescape_placeholders(yamldata, names):
+    """
+    Removes the quotes of the placeholders escape_placeholders quoted from the written document, in one pass.
+    Every quoted occurrence of them is unquoted, wherever it is: the conversion removes parts of the template
+    (e.g. the last-applied-configuration annotation) and adds others, so the occurrences cannot be told apart.
+    """
+    def unquote(match):
+        return match.group(2) if match.group(2) in names else match.group(0)
+    return QUOTED_PLACEHOLDER.sub(unquote, yamldata)
+
+
+YAML_DIRECTIVE = re.compile(r"^%YAML\b", re.MULTILINE)
+
+
+class ServingTemplate(object):
+    """
+    A ServingTemplate parsed once: the document with its placeholders escaped, and the yaml embedded
+    in spec.template.spec, parsed when first used. The checks, the conversion and write_yaml share it.
+
+    With round_trip=False the document is read with the safe (C when available) loader, several times
+    faster: enough for the checks, but it cannot be converted or written. Both read yaml 1.2, and the
+    safe loader gives the same values as round trip (as plain dict, list, int... instead of their
+    round trip subclasses), see loaders_agree.
+    Info messages of the checks are kept in messages, and printed as well when verbose.
+    """
+    def __init__(self, yamldata, filename="", round_trip=True, verbose=False):
+        self.filename = filename
+        self.round_trip = round_trip
+        self.verbose = verbose
+        self.messages = []
+        escaped, self.placeholders = escape_placeholders(yamldata)
+        try:
+            self.data = self._load(escaped)
+        except Exception:
+            raise TemplateError(None, "The content is not conforming yaml syntax. %s " % os.path.basename(filename))
+        self._spec = None
+
+    @classmethod
+    def from_file(cls, filename, **kwargs):
+        with open(filename, 'r') as fd:
+            return cls(fd.read(), filename, **kwargs)
+
+    def _load(self, yamldata):
+        if self.round_trip:
+            return ryaml.round_trip_load(yamldata, preserve_quotes=True)
+        # The C parser ignores %YAML directives (a "%YAML 1.1" document would get yes/no as strings, 017 as 17),
+        # documents with one are read by the pure Python safe loader, which follows it as round trip does
+        pure = YAML_DIRECTIVE.search(yamldata) is not None
+        return ryaml.YAML(typ="safe", pure=pure).load(yamldata)
+
+    def info(self, message):
+        self.messages.append(message)
+        if self.verbose:
+            print(message)
+
+    @property
+    def template(self):
+        return self.data['spec']['template']
+
+    @property
+    def spec(self):
+        """spec.template.spec, parsed; raises TemplateError when it is not a yaml mapping in a string"""
+        if self._spec is None:
+            embedded = self.template.get('spec')
+            try:
+                spec = self._load(embedded) if isinstance(embedded, str) else None
+            except ryaml.YAMLError:
+                spec = None
+            if not isinstance(spec, dict):
+                raise TemplateError("6")
+            self._spec = spec
+        return self._spec
+
+    @spec.setter
+    def spec(self, yaml_specs):
+        self.template['spec'] = ryaml.round_trip_dump(yaml_specs, default_flow_style=False)
+        self._spec = yaml_specs
+
+    def dump(self):
+        if not self.round_trip:
+            raise ValueError("%s was parsed for the checks only, it cannot be written" % (self.filename or "The template"))
+        readyaml = ryaml.round_trip_dump(self.data, explicit_start=True, default_flow_style=False)
+        return unescape_placeholders(readyaml, self.placeholders)
+
+
+def read_yaml(filename):
     try:
         with open(filename, 'r') as fd:
-            readyaml = fd.read()
-            readyaml, c = yaml_escape_modification(readyaml)
-            return (ryaml.round_trip_load(readyaml, preserve_quotes=True), c)
-    except:
-        print("Error: The content is not conforming yaml syntax. %s " % os.path.basename(filename))
-        sys.exit(1)
+            return fd.read()
+    except (OSError, UnicodeDecodeError):
+        raise TemplateError(None, "The content is not conforming yaml syntax. %s " % os.path.basename(filename))
 
-def write_yaml(filename, yaml_data, changes):
-    readyaml = ryaml.round_trip_dump(yaml_data, explicit_start=True, default_flow_style=False)
-    if changes is not None:
-        for n,v in changes.items():
-            if "\\n" in n:
-                continue
-            pattern = "\"" + n + "\""
-            readyaml = readyaml.replace(pattern, n)
-            pattern = "'" + n + "'"
-            readyaml = readyaml.replace(pattern, n)
+def get_yaml_from(filename):
+    # Due to the use of {{...}} the placeholders are quoted as "{{...}}" before we process them
+    return ServingTemplate(read_yaml(filename), filename, verbose=True)
 
+def write_yaml(filename, template):
     with open(filename, "w+") as fd:
-        fd.write(readyaml)
+        fd.write(template.dump())
     print("Modification Complete: %s" % filename)
 
 # This function only needs to modify the apiVersion as the validation checks for every other things
-def edit_st_v1beta1_spec(args, yaml_data):
+def edit_st_v1beta1_spec(args, template):
     # Set the apiVersion
-    yaml_data['spec']['template']['apiVersion'] = "serving.kserve.io/v1beta1"
-    return yaml_data
+    template.template['apiVersion'] = "serving.kserve.io/v1beta1"
+    return template
 
-def convert_st_v1alpha2_spec(args, yaml_data):
+def convert_st_v1alpha2_spec(args, template):
+    yaml_data = template.data
     # Set the apiVersion
     yaml_data['spec']['template']['apiVersion'] = "serving.kserve.io/v1beta1"
 
-    
-    specs = yaml_data['spec']['template'].get('spec') 
-    #yaml_specs = yaml.load(specs, Loader=yaml.loader.SafeLoader)
-    yaml_specs = ryaml.round_trip_load(specs, preserve_quotes=True)
+    yaml_specs = template.spec
     new_specs = { }
 
     for akey in yaml_specs['default'].keys():
         new_specs[akey] = {}
+        if not isinstance(yaml_specs['default'][akey], dict):
+            # Not a component with a predictor, kept as it is
+            new_specs[akey] = yaml_specs['default'][akey]
+            continue
         for bkey in yaml_specs['default'][akey].keys():
             if bkey == 'custom': 
                 new_specs[akey]['containers'] = [yaml_specs['default'][akey]['custom']['container']]
@@ -72,8 +186,8 @@ def convert_st_v1alpha2_spec(args, yaml_data):
             else:
                 new_specs[akey][bkey] = yaml_specs['default'][akey][bkey]
 
-    yaml_data['spec']['template']['spec'] = ryaml.round_trip_dump(new_specs, default_flow_style=False)
-    return yaml_data
+    template.spec = new_specs
+    return template
 
 
 def remove_serving_template_runtime(yaml_data):
@@ -81,7 +195,7 @@ def remove_serving_template_runtime(yaml_data):
     if yaml_data['metadata'].get('uid'):
         del yaml_data['metadata']['uid']
 
-    if yaml_data['metadata']['annotations'].get('kubectl.kubernetes.io/last-applied-configuration'):
+    if (yaml_data['metadata'].get('annotations') or {}).get('kubectl.kubernetes.io/last-applied-configuration'):
         del yaml_data['metadata']['annotations']['kubectl.kubernetes.io/last-applied-configuration']
 
     if yaml_data['metadata'].get('resourceVersion'):
@@ -95,155 +209,413 @@ def remove_serving_template_runtime(yaml_data):
 
     return yaml_data
 
+def _mapping(value):
+    # The checks treat a value that is not a yaml mapping like a missing one
+    return value if isinstance(value, dict) else None
+
 def is_serving_template_spec(yaml_data):
-    if yaml_data['apiVersion'] != "ai.sap.com/v1alpha1":
-        print("Error: [Code 0] Not ServingTemplate")
-        sys.exit(1)
+    # An empty document, a list or a scalar is no ServingTemplate either
+    if _mapping(yaml_data) is None or yaml_data.get('apiVersion') != "ai.sap.com/v1alpha1":
+        raise TemplateError("0")
 
-    if yaml_data['kind'] != "ServingTemplate":
-        print("Error: [Code 1] Not ServingTemplate")
-        sys.exit(1)
+    if yaml_data.get('kind') != "ServingTemplate":
+        raise TemplateError("1")
 
 
-    if yaml_data['metadata'].get('labels') is None:
-        print("Error: [Code 2] Not ServingTemplate")
-        sys.exit(1)
+    labels = _mapping((_mapping(yaml_data.get('metadata')) or {}).get('labels'))
+    if labels is None:
+        raise TemplateError("2")
 
-    if yaml_data['metadata']['labels'].get('scenarios.ai.sap.com/id') is None:
-        print("Error: [Code 3] Not ServingTemplate")
-        sys.exit(1)
+    if labels.get('scenarios.ai.sap.com/id') is None:
+        raise TemplateError("3")
 
-    if yaml_data['spec'].get('template') is None:
-        print("Error: [Code 4] Not ServingTemplate")
-        sys.exit(1)
+    if _mapping((_mapping(yaml_data.get('spec')) or {}).get('template')) is None:
+        raise TemplateError("4")
 
-def is_v1beta1_spec(yaml_data):
+def is_v1beta1_spec(template):
+    yaml_data = template.data
     ret = False
-    if yaml_data['spec']['template'].get('apiVersion') is not None and yaml_data['spec']['template']['apiVersion'].endswith("v1beta1"):
-        print("Info: v1beta1 apiVersion")
+    if isinstance(yaml_data['spec']['template'].get('apiVersion'), str) and yaml_data['spec']['template']['apiVersion'].endswith("v1beta1"):
+        template.info("Info: v1beta1 apiVersion")
         ret = True
 
     if yaml_data['spec']['template'].get('spec') is None:
-        print("Error: [Code 6] Not ServingTemplate")
-        sys.exit(1)
-
-    yaml = ryaml.YAML()
-    specs = yaml_data['spec']['template'].get('spec') 
-    #yaml_specs = yaml.load(specs, Loader=yaml.loader.SafeLoader)
-    yaml_specs = ryaml.round_trip_load(specs, preserve_quotes=True)
+        raise TemplateError("6")
 
     # Don't need to verify the detail spec of the yaml file when is not v1beta1
     if ret == False:
         return ret
 
+    yaml_specs = template.spec
+
     # Specifiy spec for v1beta1 checks
     if yaml_specs.get('predictor') is None:
-        print("Error: [Code 7] Not ServingTemplate")
-        sys.exit(1)
+        raise TemplateError("7")
+
+    if _mapping(yaml_specs['predictor']) is None:
+        raise TemplateError("8")
 
     kserve_specs = ['tensorflow', 'pmml', 'sklearn', 'lightgbm', 'pytorch', 'triton', 'containers']
     result = Counter([ True if key in kserve_specs else False for key in yaml_specs['predictor'].keys() ])
     if result.get(True) is None:
-        print("Error: [Code 8] Not ServingTemplate")
-        sys.exit(1)
+        raise TemplateError("8")
 
     if "containers" in yaml_specs['predictor'].keys():
-        if yaml_specs['predictor'].get('containers') is not None and len(yaml_specs['predictor']['containers']) == 0:
-            print("Error: [Code 9] Not ServingTemplate")
-            sys.exit(1)
+        if not isinstance(yaml_specs['predictor'].get('containers'), list) or len(yaml_specs['predictor']['containers']) == 0:
+            raise TemplateError("9")
         elif yaml_specs['predictor'].get('containers') is not None and yaml_specs['predictor'].get('imagePullSecrets') is None:
-            print("Error: [Code 9.1] Not ServingTemplate")
-            sys.exit(1)
+            raise TemplateError("9.1")
         else:
             for item in yaml_specs['predictor']['containers']:
-                if item.get('name') is None or item['name'] not in ["kserve-container", "kfserving-container"]:
-                    print("Error: [Code 10] Not ServingTemplate")
-                    sys.exit(1)
+                if _mapping(item) is None or item.get('name') not in ["kserve-container", "kfserving-container"]:
+                    raise TemplateError("10")
 
     # If everything is good we exit. There is nothing for us to do
     if yaml_data['spec']['template']['apiVersion'].startswith("serving.kserve.io"):
-        print("Info: Valid ServingTempalte with Kserve v1beta1 spec") 
-        sys.exit(0)
+        template.info("Info: Valid ServingTempalte with Kserve v1beta1 spec") 
+        raise UpToDate()
 
     # Needs to overwrite the template's apiVersion
     return ret
 
-def is_v1alpha2_spec(yaml_data):
-    if yaml_data['spec']['template'].get('apiVersion') is not None and yaml_data['spec']['template']['apiVersion'].endswith("v1alpha2"):
-        print("Info: v1alpha2 apiVersion")
+def is_v1alpha2_spec(template):
+    yaml_data = template.data
+    if isinstance(yaml_data['spec']['template'].get('apiVersion'), str) and yaml_data['spec']['template']['apiVersion'].endswith("v1alpha2"):
+        template.info("Info: v1alpha2 apiVersion")
     else:
-        print("Info: No apiVersion found")
-
+        template.info("Info: No apiVersion found")
 
-    yaml = ryaml.YAML()
-    specs = yaml_data['spec']['template'].get('spec') 
-    #yaml_specs = yaml.load(specs, Loader=yaml.loader.SafeLoader)
-    yaml_specs = ryaml.round_trip_load(specs, preserve_quotes=True)
+    yaml_specs = template.spec
 
-    if yaml_specs.get('default') is None:
-        print("Error: [Code 11] Not ServingTemplate")
-        sys.exit(1)
+    if _mapping(yaml_specs.get('default')) is None:
+        raise TemplateError("11")
 
-    if yaml_specs['default'].get('predictor') is None:
-        print("Error: [Code 12] Not ServingTemplate")
-        sys.exit(1)
+    if _mapping(yaml_specs['default'].get('predictor')) is None:
+        raise TemplateError("12")
 
     kf_specs = ['tensorflow', 'pmml', 'sklearn', 'lightgbm', 'pytorch', 'triton', 'custom']
     result = Counter([ True if key in kf_specs else False for key in yaml_specs['default']['predictor'].keys() ])
     if result.get(True) is None:
-        print("Error: [Code 13] Not ServingTemplate")
-        sys.exit(1)
+        raise TemplateError("13")
 
 
-    if yaml_specs['default']['predictor'].get('custom') is not None and yaml_specs['default']['predictor']['custom'].get('container') is not None: 
-        if yaml_specs['default']['predictor']['custom']['container'].get('name') is None or yaml_specs['default']['predictor']['custom']['container']['name'] != "kfserving-container":
-            print("Error: [Code 14] Not ServingTemplate")
-            sys.exit(1)
+    # The conversion moves custom.container to containers, it has to be there
+    custom = yaml_specs['default']['predictor'].get('custom')
+    if custom is not None:
+        container = custom.get('container') if _mapping(custom) is not None else None
+        if _mapping(container) is None or container.get('name') != "kfserving-container":
+            raise TemplateError("14")
         elif yaml_data['spec'].get('imagePullSecrets') is None:
-            print("Error: [Code 15] Not ServingTemplate")
-            sys.exit(1)
+            raise TemplateError("15")
+
+    template.info("Info: Valid ServingTempalte with kfserving v1alpha2 spec") 
+
+Issue = namedtuple("Issue", ["code", "level", "message"])
+Issue.__doc__ = """A finding of validate: level "error" with the code of the README table, or "warning" when the template needs conversion"""
+
+CONVERSION_NEEDED = {
+    "v1beta1": "The template apiVersion needs to be serving.kserve.io/v1beta1",
+    "v1alpha2": "The template uses the kfserving v1alpha2 spec, it needs conversion to serving.kserve.io/v1beta1",
+}
+
+
+def check(template):
+    """
+    Runs the checks on a ServingTemplate. Raises TemplateError when it is not a valid one, returns None
+    when it is a valid v1beta1 one already, "v1beta1" when only its apiVersion is to be set, "v1alpha2" to convert it.
+    """
+    # if is not a servingtemplate it will just quit
+    is_serving_template_spec(template.data)
+
+    # if is a servingtemplate v1beta1, but apiVersion is incorrect.
+    # if is a perfect servingtemplate v1beta1 we stop with a smile in the function.
+    try:
+        if is_v1beta1_spec(template):
+            return "v1beta1"
+    except UpToDate:
+        return None
+    is_v1alpha2_spec(template)
+    return "v1alpha2"
+
+
+def validate(template, cache=None):
+    """
+    Checks a ServingTemplate, given as yaml text or ServingTemplate. Returns the list of Issue, empty when
+    it is a valid v1beta1 ServingTemplate. Yaml text is only parsed with the fast safe loader, and with a
+    ValidationCache its result is looked up and stored by content, shared with the script's runs.
+    """
+    key = None
+    if cache is not None and not isinstance(template, ServingTemplate):
+        key = ValidationCache.key(template)
+        cached = cache.get(key)
+        if cached is not None:
+            return _issues(*cached)
+    messages = []
+    try:
+        if not isinstance(template, ServingTemplate):
+            template = ServingTemplate(template, round_trip=False)
+        messages = template.messages
+        kind = check(template)
+    except TemplateError as error:
+        result = ("error", error.code, messages + [str(error)], None)
+    else:
+        result = ("valid" if kind is None else "needs modification", None, template.messages, kind)
+    if key is not None:
+        cache.put(key, *result)
+    return _issues(*result)
+
+
+def _issues(status, code, messages, kind):
+    # From a result of the checks as kept in ValidationCache: the error is the last message
+    if status == "error":
+        return [Issue(code, "error", messages[-1])]
+    if kind is None:
+        return []
+    return [Issue(None, "warning", CONVERSION_NEEDED[kind])]
+
+
+def loaders_agree(yamldata):
+    """
+    Whether the fast safe loader of the checks reads yamldata (a ServingTemplate) as the round trip loader
+    of the conversion does, embedded spec included. Used by benchmark_placeholders.py on its templates.
+    """
+    fast, round_trip = ServingTemplate(yamldata, round_trip=False), ServingTemplate(yamldata)
+    if fast.data != round_trip.data:
+        return False
+    try:
+        return fast.spec == round_trip.spec
+    except (KeyError, TypeError):
+        # No embedded spec to compare
+        return True
+
+
+def _convert(template, kind):
+    if kind == "v1beta1":
+        template = edit_st_v1beta1_spec(None, template)
+    elif kind == "v1alpha2":
+        template = convert_st_v1alpha2_spec(None, template)
+    else:
+        return template
+    # Remove any unnecessary annotation in the template
+    remove_serving_template_runtime(template.data)
+    return template
+
+
+def convert(template):
+    """
+    Converts a ServingTemplate to the kserve v1beta1 spec, raises TemplateError if it is not a valid one.
+    Given yaml text, returns the converted yaml text: the text is checked with the fast safe loader first,
+    and returned as it is, without the round trip parsing, when it is a valid v1beta1 template already.
+    Given a ServingTemplate (parsed with round_trip), converts and returns it.
+    """
+    if isinstance(template, ServingTemplate):
+        return _convert(template, check(template))
+    kind = check(ServingTemplate(template, round_trip=False))
+    if kind is None:
+        return template
+    return _convert(ServingTemplate(template), kind).dump()
+
+
+class ValidationCache(object):
+    """
+    The results of the checks by content hash, kept in a json file between runs, so that unchanged templates
+    are not checked again. The entries are only used with the same version of this script.
+    """
+    def __init__(self, path=None):
+        self.path = path
+        self.entries = {}
+        self.added = {}
+        if path is None:
+            return
+        try:
+            with open(path, 'r') as fd:
+                cached = json.load(fd)
+        except (OSError, ValueError):
+            return
+        if cached.get("version") == SCRIPT_VERSION:
+            self.entries = cached.get("entries", {})
+
+    @staticmethod
+    def key(yamldata):
+        return hashlib.sha256(yamldata.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        """
+        (status, code, messages, kind) of the template with this key, None if it was not checked yet;
+        kind is what check returned for templates that need modification
+        """
+        return self.entries.get(key)
+
+    def put(self, key, status, code, messages, kind=None):
+        self.entries[key] = self.added[key] = [status, code, messages, kind]
+
+    def update(self, entries):
+        self.entries.update(entries)
+        self.added.update(entries)
+
+    def save(self):
+        if self.path is None or not self.added:
+            return
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        with tempfile.NamedTemporaryFile("w", dir=directory, delete=False) as fd:
+            json.dump({"version": SCRIPT_VERSION, "entries": self.entries}, fd)
+        os.replace(fd.name, self.path)
+        self.added = {}
+
+
+def process_file(filename, inplace=False, test=False, cache=None):
+    """
+    Checks and converts one ServingTemplate.
+    Returns the status: "converted", "needs modification" (with test), "valid" (already v1beta1) or "error"
+    and the error code (None when there is no error, or the file is not yaml).
+    """
+    key = template = None
+    try:
+        yamldata = read_yaml(filename)
+        key = ValidationCache.key(yamldata)
+        cached = cache.get(key) if cache is not None else None
+        if cached is not None and (test or cached[0] != "needs modification"):
+            status, code, messages, _ = cached
+            for message in messages:
+                print(message)
+            return (status, code)
+
+        # Checked with the fast loader, only templates to convert are parsed again with round trip
+        template = ServingTemplate(yamldata, filename, round_trip=False, verbose=True)
+        kind = check(template)
+    except TemplateError as error:
+        print(error)
+        if key is not None and cache is not None:
+            cache.put(key, "error", error.code, (template.messages if template is not None else []) + [str(error)])
+        return ("error", error.code)
+
+    status = "valid" if kind is None else "needs modification"
+    if cache is not None:
+        cache.put(key, status, None, template.messages, kind)
+    if test or kind is None:
+        return (status, None)
+
+    # The document and its embedded spec are parsed once more, with round trip, and shared by the conversion
+    template = _convert(ServingTemplate(yamldata, filename), kind)
+
+    if not inplace:
+        filename = os.path.splitext(filename)[0] + ".mod.yaml"
+    write_yaml(filename, template)
+    return ("converted", None)
+
+
+_worker_cache = None
+
+def _init_worker(cache):
+    global _worker_cache
+    _worker_cache = cache
+
+
+def process_file_captured(job):
+    """
+    process_file in a worker process: returns (filename, status, code, output) with everything it printed,
+    and the results it added to the worker's copy of the cache
+    """
+    filename, inplace, test = job
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        status, code = process_file(filename, inplace, test, _worker_cache)
+    added = {}
+    if _worker_cache is not None:
+        added, _worker_cache.added = _worker_cache.added, {}
+    return (filename, status, code, output.getvalue(), added)
+
+
+def _is_input_yaml(name):
+    return name.endswith(YAML_EXTENSIONS) and not name.endswith(".mod.yaml")
+
+
+def collect_files(paths):
+    """
+    The yaml files of the given files, directories (recursively) and glob patterns, without the .mod.yaml outputs.
+    Files named explicitly are taken as they are.
+    """
+    files = []
+    for path in paths:
+        pattern = glob.has_magic(path)
+        matches = sorted(glob.glob(path, recursive=True)) if pattern else [path]
+        for match in matches:
+            if os.path.isdir(match):
+                for root, dirs, names in os.walk(match):
+                    dirs[:] = sorted(d for d in dirs if not d.startswith("."))
+                    files.extend(os.path.join(root, name) for name in sorted(names) if _is_input_yaml(name))
+            elif os.path.isfile(match):
+                if not pattern or _is_input_yaml(match):
+                    files.append(match)
+            else:
+                print("Error: {0} is not a file.".format(match))
+    return list(OrderedDict.fromkeys(os.path.realpath(f) for f in files))
+
+
+def print_report(results, verbose=False):
+    statuses = Counter(status for _, status, _, _ in results)
+    codes = Counter(code for _, status, code, _ in results if status == "error")
+    for filename, status, code, output in results:
+        if verbose or status == "error":
+            print("%s: %s" % (filename, status))
+            for line in output.strip().splitlines():
+                print("    " + line)
+    print("Summary: %d files" % len(results))
+    for status in ("converted", "needs modification", "valid", "error"):
+        if statuses.get(status):
+            print("  %-20s %d" % (status, statuses[status]))
+    for code, count in sorted(codes.items(), key=lambda item: (item[0] is None, str(item[0]))):
+        print("    %-18s %d" % ("Code %s" % code if code is not None else "no code", count))
 
-    print("Info: Valid ServingTempalte with kfserving v1alpha2 spec") 
 
 def main():
     parser = argparse.ArgumentParser()
-    parser.add_argument("yaml_filename", type=str, help="ServingTemplate Yaml")
+    parser.add_argument("yaml_filename", type=str, nargs="+",
+                        help="ServingTemplate Yaml, or directories / glob patterns to process every yaml file in them")
     exclusive_parser = parser.add_mutually_exclusive_group()
     exclusive_parser.add_argument('-i', dest="inplace", action='store_true', help="Inplace yaml update")
     exclusive_parser.add_argument('-t', "--test", dest="test", action='store_true', help="Test the yaml file need modification")
+    parser.add_argument('-j', "--jobs", dest="jobs", type=int, default=os.cpu_count(), help="Worker processes for many files")
+    parser.add_argument('-v', "--verbose", dest="verbose", action='store_true', help="Print the output of every file, not only of the failing ones")
+    parser.add_argument("--cache", dest="cache", default=DEFAULT_CACHE, help="Results of the checks by file content, to skip unchanged files")
+    parser.add_argument("--no-cache", dest="no_cache", action='store_true', help="Check every file again")
 
     args = parser.parse_args()
-
-    filename = os.path.realpath(args.yaml_filename)
-    if not os.path.isfile(filename) or not os.path.exists(filename):
-        print("Error: {0} is not a file.".format(args.yaml_filename))
+    cache = None if args.no_cache else ValidationCache(args.cache)
+
+    if len(args.yaml_filename) == 1 and os.path.isfile(args.yaml_filename[0]):
+        filename = os.path.realpath(args.yaml_filename[0])
+        status, code = process_file(filename, args.inplace, args.test, cache)
+        if cache is not None:
+            cache.save()
+        sys.exit(1 if status == "error" else 0)
+
+    files = collect_files(args.yaml_filename)
+    if not files:
+        print("Error: No yaml file found in {0}".format(" ".join(args.yaml_filename)))
         sys.exit(1)
 
-    # Due to the use of {{...}} there is a need to filter them in sub_groups
-    # and sub them as "{{...}}" before we process them
-    yaml_data, sub_groups = get_yaml_from(filename) 
-
-    # if is not a servingtemplate it will just quit
-    is_serving_template_spec(yaml_data)
-
-    # if is a servingtemplate v1beta1, but apiVersion is incorrect.
-    # if is a perfect servingtemplate v1beta1 we exit with a smile in the function.
-    if is_v1beta1_spec(yaml_data):
-        yaml_data = edit_st_v1beta1_spec(args, yaml_data)    
+    jobs = [(filename, args.inplace, args.test) for filename in files]
+    if args.jobs > 1 and len(files) > 1:
+        # Every worker gets a copy of the cache, and returns the results it added
+        with concurrent.futures.ProcessPoolExecutor(max_workers=args.jobs, initializer=_init_worker,
+                                                    initargs=(cache,)) as executor:
+            # Several files per task, the files are small compared to the cost of a round trip to a worker
+            chunksize = max(1, len(jobs) // (args.jobs * 4))
+            results = list(executor.map(process_file_captured, jobs, chunksize=chunksize))
     else:
-        is_v1alpha2_spec(yaml_data)
-        yaml_data = convert_st_v1alpha2_spec(args, yaml_data)    
+        _init_worker(cache)
+        results = [process_file_captured(job) for job in jobs]
+    if cache is not None:
+        for result in results:
+            cache.update(result[4])
+        cache.save()
 
-    # Remove any unnecessary annotation in the template
-    yaml_data = remove_serving_template_runtime(yaml_data)
-
-    if args.test:
-        sys.exit(0)
+    results = [result[:4] for result in results]
+    print_report(results, args.verbose)
+    sys.exit(1 if any(status == "error" for _, status, _, _ in results) else 0)
 
-    if not args.inplace:
-        filename = os.path.splitext(filename)[0] + ".mod.yaml"
-    write_yaml(filename, yaml_data, sub_groups)
-        
 
 if __name__ == "__main__":
     main()
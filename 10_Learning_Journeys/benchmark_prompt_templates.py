@@ -0,0 +1,57 @@
+"""
+Rendering time of the prompts of rewrite_messages.py: `fill_prompt_template` on every
+record against `CompiledPrompt`, compiled once with the constant inputs.
+
+    python benchmark_prompt_templates.py --renders 100000
+"""
+import argparse
+import pathlib
+import random
+import time
+
+import yaml
+
+from prompt_templates import CompiledPrompt, extract_categories_to_dict, fill_prompt_template, render_categories
+
+HERE = pathlib.Path(__file__).parent
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--renders', type=int, default=100000)
+    args = parser.parse_args()
+
+    with (HERE / 'rewrite-messages.yaml').open() as stream:
+        prompt = yaml.safe_load(stream)['assign-labels']
+    category_dict = extract_categories_to_dict((HERE / 'service-categories.md').read_text())
+    urgency_dict = extract_categories_to_dict((HERE / 'urgency-description.md').read_text())
+    rng = random.Random(0)
+    messages = [' '.join(rng.choice(['support', 'mail', 'urgent', 'cleaning', 'invoice']) for _ in range(200))
+                for _ in range(1000)]
+
+    def recursive(message):
+        # What rewrite_messages.py did for every entry
+        return fill_prompt_template(
+            prompt,
+            message=message,
+            urgency_description=render_categories(urgency_dict, urgency_dict.keys()),
+            categories=render_categories(category_dict, category_dict.keys())
+        )
+
+    compiled = CompiledPrompt(
+        prompt,
+        urgency_description=render_categories(urgency_dict, urgency_dict.keys()),
+        categories=render_categories(category_dict, category_dict.keys()),
+    )
+    assert compiled.render(message=messages[0]) == recursive(messages[0])
+
+    for name, render in (('fill_prompt_template', recursive), ('CompiledPrompt', lambda m: compiled.render(message=m))):
+        start = time.perf_counter()
+        for i in range(args.renders):
+            render(messages[i % len(messages)])
+        elapsed = time.perf_counter() - start
+        print(f'{name:<22} {args.renders} renders in {elapsed:.3f} s ({elapsed / args.renders * 1e6:.2f} us/render)')
+
+
+if __name__ == '__main__':
+    main()
@@ -2,39 +2,24 @@ from typing import Literal, Type, Union, Dict, Any, List
 import re
 import pathlib
 from enum import Enum
-import time
 import json
 import uuid
+import random
+import asyncio
+import argparse
 
 import yaml
-from datasets import load_dataset
 from pydantic import BaseModel, Field
 import instructor
 
-HERE = pathlib.Path(__file__).parent
-
-
-
-class RateLimitedIterator:
-    def __init__(self, iterable, max_iterations_per_minute):
-        self._iterable = iter(iterable)
-        self._max_iterations_per_minute = max_iterations_per_minute
-        self._min_interval = 1.0 / (max_iterations_per_minute / 60.)
-        self._last_yield_time = None
-
-    def __iter__(self):
-        return self
+from jsonl_sink import JsonlSink
+import llm_cache
+from persona_sampler import PersonaSampler
+from prompt_templates import CompiledPrompt, extract_categories_to_dict
+from rate_limiting import RateLimiter, map_unordered
 
-    def __next__(self):
-        current_time = time.time()
-
-        if self._last_yield_time is not None:
-            elapsed_time = current_time - self._last_yield_time
-            if elapsed_time < self._min_interval:
-                time.sleep(self._min_interval - elapsed_time)
+HERE = pathlib.Path(__file__).parent
 
-        self._last_yield_time = time.time()
-        return next(self._iterable)
 
 
 class Sentiment(str, Enum):
@@ -70,40 +55,48 @@ class Match(BaseModel):
         return sum(scores) / len(scores)
 
 
-def fill_prompt_template(prompt: Union[str, List[Any], Dict[Any, Any]], **kwargs) -> Union[str, List[Any], Dict[Any, Any]]:
-    if isinstance(prompt, str):
-        return prompt.format(**kwargs)
-    elif isinstance(prompt, list):
-        return [fill_prompt_template(item, **kwargs) for item in prompt]
-    elif isinstance(prompt, dict):
-        return {key: fill_prompt_template(value, **kwargs) for key, value in prompt.items()}
-    else:
-        return prompt
+def draft_inputs(category_dict: Dict[str, str], persona: str) -> Dict[str, str]:
+    category = random.choice([*category_dict.keys()])
+    return dict(
+        id=str(uuid.uuid4()),
+        persona=persona,
+        category=category,
+        category_description=category_dict[category],
+        urgency=str(random.choice(list(Urgency))),
+        sentiment=str(random.choice(list(Sentiment))),
+    )
 
 
-def extract_categories_to_dict(text: str) -> dict:
-    # Split the text into sections based on the numbered list
-    sections = re.split(r'\n(?=\d+\.\s+\*\*)', text)
-    categories_dict = {}
+async def generate_mails(client, limiter: RateLimiter, draft_prompt, company: str, inputs, model: str = 'gpt-4o'):
+    """Async generator of drafted mails, in completion order, keeping the limiter's in-flight budget busy."""
+    prompt = CompiledPrompt(draft_prompt, company=company)
 
-    for section in sections:
-        # Extract the header and the content
-        header_match = re.search(r'\*\*(.*?)\*\*', section)
-        if header_match:
-            header = header_match.group(1).lower().replace(' ', '_')
-            # Remove the header and leading number from the section
-            content = [l.lstrip("1234567890. ") for l in section.splitlines()]
-            categories_dict[header] = '\n'.join(content)
-    return categories_dict
+    async def draft(kwargs):
+        mail = await limiter.call(
+            client.chat.completions.create,
+            model=model,
+            messages=prompt.render(**kwargs),
+            temperature=0.0,
+        )
+        return {**kwargs, "message": mail.choices[0].message.content}
 
+    async for record in map_unordered(draft, inputs, limit=2 * limiter.max_in_flight):
+        yield record
+
+
+async def main(args):
+    if args.base_url:
+        from openai import OpenAI
+        client = OpenAI(base_url=args.base_url, api_key='stub', max_retries=0)
+    else:
+        from gen_ai_hub.proxy.native.openai import OpenAI
+        client = OpenAI()
+    cache = llm_cache.from_arguments(args)
+    if cache is not None:
+        client = llm_cache.CachedClient(client, cache)
 
-if __name__ == '__main__':
-    from gen_ai_hub.proxy.native.openai import OpenAI
-    import random
     with (HERE / 'draft-mail.yaml').open() as stream:
         draft_prompt = yaml.safe_load(stream)
-    client = OpenAI()
-    instructor_client = instructor.from_openai(client)
 
     with (HERE / 'service-categories.md').open() as stream:
         categories_description = stream.read()
@@ -112,24 +105,34 @@ if __name__ == '__main__':
     with (HERE / 'company-scope.md').open() as stream:
         company_description = stream.read()
 
-    personas = load_dataset("proj-persona/PersonaHub", 'persona', split='train')
-
-    for _ in RateLimitedIterator(range(1000), 10):
-        category = random.choice([*category_dict.keys()])
-        kwargs = dict(
-            id=str(uuid.uuid4()),
-            persona=random.choice(personas)['persona'],
-            category=category,
-            category_description=category_dict[category],
-            urgency=str(random.choice(list(Urgency))),
-            sentiment=str(random.choice(list(Sentiment))),
-        )
+    limiter = RateLimiter(args.requests_per_minute, args.tokens_per_minute, max_in_flight=args.max_in_flight)
+    with JsonlSink(args.output) as sink:
+        # With --resume, --count is the total number of mails in the output, not the number to add
+        count = max(0, args.count - len(sink)) if args.resume else args.count
+        # Seeded with the number of mails already written, so a resumed run does not draw the same personas again
+        seed = None if args.seed is None else [args.seed, len(sink)]
+        personas = PersonaSampler(args.personas, count, seed=seed)
+        print(f'{len(personas)} personas drawn from {personas.total} ({personas.nbytes / 2**20:.1f} MiB)')
+        inputs = (draft_inputs(category_dict, persona) for persona in personas)
+        async for record in generate_mails(client, limiter, draft_prompt, company_description, inputs, model=args.model):
+            sink.write(record)
+    print(limiter.stats)
+    if cache is not None:
+        print(f'Response cache: {cache.stats()}')
 
-        mail = client.chat.completions.create(
-            model='gpt-4o',
-            messages=fill_prompt_template(draft_prompt, company=company_description,**kwargs),
-            temperature=0.0,
-        )
-        kwargs["message"] = mail.choices[0].message.content
-        with open(HERE / 'mails.jsonl', 'a') as stream:
-            stream.write(json.dumps(kwargs)+'\n')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--count', type=int, default=1000, help='Number of mails to draft')
+    parser.add_argument('--model', default='gpt-4o')
+    parser.add_argument('--personas', default='proj-persona/PersonaHub',
+                        help='Persona corpus: a hub dataset, or a local Parquet/Arrow file or directory to run offline')
+    parser.add_argument('--seed', type=int, default=None, help='Seed of the persona draws, random if not set')
+    parser.add_argument('--requests-per-minute', type=float, default=10)
+    parser.add_argument('--tokens-per-minute', type=float, default=None, help='Token quota of the deployment, unlimited if not set')
+    parser.add_argument('--max-in-flight', type=int, default=8, help='Concurrent requests')
+    llm_cache.add_arguments(parser, HERE / '.llm-cache.sqlite')
+    parser.add_argument('--base-url', default=None, help='OpenAI compatible endpoint instead of the generative AI hub, e.g. stub_openai_server.py')
+    parser.add_argument('--output', default=str(HERE / 'mails.jsonl'))
+    parser.add_argument('--resume', action='store_true', help='Only draft the mails missing to reach --count')
+    asyncio.run(main(parser.parse_args()))
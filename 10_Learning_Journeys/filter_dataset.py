@@ -1,35 +1,184 @@
+"""
+Picks mails of increasing difficulty from the rewritten mails, by their `quality_score`:
+
+    rank      (default) the best 200 are "easiest", the next 200 "easy", ... as consecutive ranks
+    quantile  the scores are cut at quantiles into as many buckets, and each bucket is sampled
+
+    python filter_dataset.py --input mails-v4.jsonl --buckets easiest,easy,medium,hard,hardest --bucket-size 200
+
+The input is streamed: one pass keeps only the score and file offset of every line, the
+buckets are found by partial selection (no full sort), and only the selected lines are
+read again and written, record by record, to `filtered_mails-<bucket>.jsonl` / `.yaml`.
+"""
+from array import array
+import argparse
 import json
 import random
+import re
 
-from datasets import load_dataset
-
+import numpy as np
 import yaml
 
+SCORE = re.compile(rb'"quality_score":\s*(-?[0-9.eE+-]+|null)')
+
 
 def str_presenter(dumper, data):
     if '\n' in data:  # Check for multiline string
         return dumper.represent_scalar('tag:yaml.org,2002:str', data, style='|')
     return dumper.represent_scalar('tag:yaml.org,2002:str', data)
 
-yaml.add_representer(str, str_presenter)
-
-dataset = load_dataset("json", data_files=["mails-v4.jsonl"], split='train')
-sorted_dataset = dataset.sort("quality_score", reverse=True)
-for offset, category in [(0, "easiest"), (200, "easy"), (400, "medium"), (600, "hard"), (800, "hardest")]:
-    lines = []
-    cropped_dataset = sorted_dataset.select([offset+i for i in range(200)])
-
-
-    l = []
-    for entry in cropped_dataset:
-        l.append({
-            "id": entry["id"],
-            "message": entry["message"],
-            "ground_truth": entry["ground_truth"]
-        })
-    random.seed(42)
-    random.shuffle(l)
-    with open(f"filtered_mails-{category}.yaml", "w") as f:
-        yaml.dump(l, f, allow_unicode=True)
-    with open(f"filtered_mails-{category}.jsonl", "w") as f:
-        f.write("\n".join([json.dumps(m) for m in l]))
+# The pure Python emitter: libyaml's CDumper cannot write characters outside the BMP (e.g. emoji)
+# in block scalars and would turn those mails into escaped double-quoted strings
+Dumper = yaml.Dumper
+yaml.add_representer(str, str_presenter, Dumper=Dumper)
+
+
+def scan_scores(path):
+    """
+    Returns:
+        (score, byte offset) of every line, as compact arrays; lines without a score get NaN
+    """
+    scores, offsets = array('d'), array('q')
+    offset = 0
+    with open(path, 'rb') as stream:
+        for line in stream:
+            if line.strip():
+                match = SCORE.search(line)
+                value = match.group(1) if match else None
+                if value is None:
+                    value = json.loads(line).get("quality_score")  # not written as expected, parse the line
+                scores.append(float('nan') if value in (None, b'null') else float(value))
+                offsets.append(offset)
+            offset += len(line)
+    return np.frombuffer(scores, dtype=np.float64), np.frombuffer(offsets, dtype=np.int64)
+
+
+def rank_buckets(scores, sizes):
+    """
+    Consecutive ranks of the descending scores, ties in file order (as a stable sort would give)
+
+    Only the rows at or above the score of the last selected rank are sorted.
+    """
+    total = min(sum(sizes), len(scores))
+    if total == 0:
+        return [np.empty(0, dtype=np.int64) for _ in sizes]
+    keys = np.where(np.isnan(scores), -np.inf, scores)
+    threshold = np.partition(keys, len(keys) - total)[len(keys) - total]
+    candidates = np.flatnonzero(keys >= threshold)
+    selected = candidates[np.lexsort((candidates, -keys[candidates]))][:total]
+    bounds = np.cumsum([0] + list(sizes))
+    return [selected[start:end] for start, end in zip(bounds[:-1], bounds[1:])]
+
+
+def quantile_buckets(scores, sizes, seed=42):
+    """
+    Buckets between score quantiles, from the highest scores to the lowest, each sampled down to its size
+    """
+    valid = np.flatnonzero(~np.isnan(scores))
+    edges = np.quantile(scores[valid], np.linspace(1, 0, len(sizes) + 1))
+    rng = np.random.default_rng(seed)
+    buckets = []
+    for i, size in enumerate(sizes):
+        upper, lower = edges[i], edges[i + 1]
+        in_bucket = (scores[valid] <= upper) & (scores[valid] > lower if i < len(sizes) - 1 else scores[valid] >= lower)
+        members = valid[in_bucket]
+        if len(members) > size:
+            members = np.sort(rng.choice(members, size, replace=False))
+        buckets.append(members)
+    return buckets
+
+
+def read_lines(path, offsets):
+    """The lines at `offsets`, in the given order"""
+    order = np.argsort(offsets, kind='stable')
+    lines = [None] * len(offsets)
+    with open(path, 'rb') as stream:
+        for i in order:
+            stream.seek(offsets[i])
+            lines[i] = stream.readline()
+    return lines
+
+
+def node_events(dumper, node):
+    """The events `yaml.dump` would emit for `node` (without anchors, the mails have no shared objects)"""
+    if isinstance(node, yaml.ScalarNode):
+        implicit = (node.tag == dumper.resolve(yaml.ScalarNode, node.value, (True, False)),
+                    node.tag == dumper.resolve(yaml.ScalarNode, node.value, (False, True)))
+        yield yaml.ScalarEvent(None, node.tag, implicit, node.value, style=node.style)
+    elif isinstance(node, yaml.SequenceNode):
+        implicit = node.tag == dumper.resolve(yaml.SequenceNode, node.value, True)
+        yield yaml.SequenceStartEvent(None, node.tag, implicit, flow_style=node.flow_style)
+        for item in node.value:
+            yield from node_events(dumper, item)
+        yield yaml.SequenceEndEvent()
+    else:
+        implicit = node.tag == dumper.resolve(yaml.MappingNode, node.value, True)
+        yield yaml.MappingStartEvent(None, node.tag, implicit, flow_style=node.flow_style)
+        for key, value in node.value:
+            yield from node_events(dumper, key)
+            yield from node_events(dumper, value)
+        yield yaml.MappingEndEvent()
+
+
+class YamlListWriter:
+    """Writes one YAML list item by item, with the same output as `yaml.dump(items, allow_unicode=True)`"""
+
+    def __init__(self, stream):
+        self.dumper = Dumper(stream, allow_unicode=True)
+        for event in (yaml.StreamStartEvent(), yaml.DocumentStartEvent(),
+                      yaml.SequenceStartEvent(None, None, True, flow_style=False)):
+            self.dumper.emit(event)
+
+    def write(self, item):
+        node = self.dumper.represent_data(item)
+        self.dumper.represented_objects = {}
+        for event in node_events(self.dumper, node):
+            self.dumper.emit(event)
+
+    def close(self):
+        for event in (yaml.SequenceEndEvent(), yaml.DocumentEndEvent(), yaml.StreamEndEvent()):
+            self.dumper.emit(event)
+
+
+def write_bucket(name, entries):
+    with open(f"filtered_mails-{name}.yaml", "w") as yaml_stream, open(f"filtered_mails-{name}.jsonl", "w") as jsonl_stream:
+        writer = YamlListWriter(yaml_stream)
+        for i, entry in enumerate(entries):
+            writer.write(entry)
+            jsonl_stream.write(("\n" if i else "") + json.dumps(entry))
+        writer.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--input", default="mails-v4.jsonl")
+    parser.add_argument("--buckets", default="easiest,easy,medium,hard,hardest", help="Bucket names, from the highest scores")
+    parser.add_argument("--bucket-size", default="200", help="Mails per bucket, or a comma separated size per bucket")
+    parser.add_argument("--mode", choices=("rank", "quantile"), default="rank")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    names = args.buckets.split(',')
+    sizes = [int(size) for size in args.bucket_size.split(',')]
+    if len(sizes) == 1:
+        sizes = sizes * len(names)
+
+    scores, offsets = scan_scores(args.input)
+    buckets = rank_buckets(scores, sizes) if args.mode == "rank" else quantile_buckets(scores, sizes, args.seed)
+    for name, rows in zip(names, buckets):
+        l = []
+        for line in read_lines(args.input, offsets[rows]):
+            entry = json.loads(line)
+            l.append({
+                "id": entry["id"],
+                "message": entry["message"],
+                "ground_truth": entry["ground_truth"]
+            })
+        random.seed(args.seed)
+        random.shuffle(l)
+        write_bucket(name, l)
+        print(f"{name}: {len(l)} mails")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+from typing import Any, Dict, Iterable, List, Set, Tuple, Union
+import json
+import os
+import pathlib
+import threading
+import time
+
+COMMIT_PREFIX = b'#'
+
+
+def scan_ids(path: Union[str, pathlib.Path], id_field: str = 'id') -> Tuple[List[str], int]:
+    """
+    Ids of a JSONL file that has no index, and the size up to its last complete line.
+
+    Both generators write the id as the first key (`{"id": "...", ...`), so it is sliced
+    from the start of the line; only lines where that does not hold are parsed as JSON.
+    """
+    prefix = b'{"%s": "' % id_field.encode()
+    start = len(prefix)
+    ids, size = [], 0
+    with open(path, 'rb') as stream:
+        for line in stream:
+            if not line.endswith(b'\n'):
+                break
+            end = line.find(b'"', start)
+            if line.startswith(prefix) and b'\\' not in line[start:end]:
+                ids.append(line[start:end].decode('utf-8'))
+            else:
+                ids.append(str(json.loads(line)[id_field]))
+            size += len(line)
+    return ids, size
+
+
+def read_index(index_path: Union[str, pathlib.Path]) -> Tuple[Set[str], int, int]:
+    """
+    Returns:
+        (committed ids, committed size of the output, size of the index up to its last commit)
+    """
+    ids, pending, committed_size, index_size, offset = set(), [], 0, 0, 0
+    with open(index_path, 'rb') as stream:
+        for line in stream:
+            offset += len(line)
+            if not line.endswith(b'\n'):
+                break  # torn last line
+            if line.startswith(COMMIT_PREFIX):
+                ids.update(pending)
+                pending = []
+                committed_size, index_size = int(line[1:]), offset
+            else:
+                pending.append(line[:-1].decode('utf-8'))
+    return ids, committed_size, index_size
+
+
+def read_ids(path: Union[str, pathlib.Path], id_field: str = 'id') -> Set[str]:
+    """Ids written to the JSONL output `path`, without opening it for writing (e.g. from another process)."""
+    path = pathlib.Path(path)
+    index_path = path.with_name(path.name + '.ids')
+    if index_path.exists():
+        return read_index(index_path)[0]
+    if path.exists():
+        return set(scan_ids(path, id_field)[0])
+    return set()
+
+
+class JsonlSink:
+    """
+    Buffered, crash-safe JSONL writer with an index of the ids it has written.
+
+    Records are buffered and written in batches, when `flush_records` are pending or
+    `flush_seconds` passed. Every batch is fsync'ed, then its ids are appended to
+    `<output>.ids` followed by a commit line `#<bytes of the output>`, fsync'ed too.
+
+    On open, everything written after the last commit (a torn line, or records whose
+    ids did not make it into the index) is cut off, so the output and the index always
+    agree. Resuming only reads the index, never the JSONL file itself.
+    """
+
+    def __init__(self, path: Union[str, pathlib.Path], id_field: str = 'id', flush_records: int = 100,
+                 flush_seconds: float = 5.0, fsync: bool = True):
+        self.path = pathlib.Path(path)
+        self.index_path = self.path.with_name(self.path.name + '.ids')
+        self.id_field = id_field
+        self.flush_records = flush_records
+        self.flush_seconds = flush_seconds
+        self.fsync = fsync
+        self._ids = self._recover()
+        self._buffer: List[str] = []
+        self._buffer_ids: List[str] = []
+        self._lock = threading.Lock()
+        self._last_flush = time.monotonic()
+        self._data = self.path.open('ab')
+        self._index = self.index_path.open('ab')
+        self._closed = threading.Event()
+        self._timer = threading.Thread(target=self._flush_periodically, daemon=True)
+        self._timer.start()
+
+    def _recover(self) -> Set[str]:
+        if not self.index_path.exists():
+            if self.path.exists() and self.path.stat().st_size:
+                return self._build_index()
+            return set()
+        ids, committed_size, index_size = read_index(self.index_path)
+        self._truncate(self.index_path, index_size)
+        if self.path.exists():
+            self._truncate(self.path, committed_size)
+        return ids
+
+    def _build_index(self) -> Set[str]:
+        """One-off index for an output written before the sink existed, cutting a torn last line."""
+        ids, size = scan_ids(self.path, self.id_field)
+        self._truncate(self.path, size)
+        with self.index_path.open('wb') as stream:
+            stream.write(self._index_entry(ids, size))
+        return set(ids)
+
+    @staticmethod
+    def _index_entry(ids: Iterable[str], size: int) -> bytes:
+        return ''.join(f'{record_id}\n' for record_id in ids).encode('utf-8') + COMMIT_PREFIX + b'%d\n' % size
+
+    @staticmethod
+    def _truncate(path: pathlib.Path, size: int):
+        if path.stat().st_size > size:
+            with path.open('r+b') as stream:
+                stream.truncate(size)
+
+    def completed_ids(self) -> Set[str]:
+        """Ids of the records written so far, including those still buffered."""
+        with self._lock:
+            return self._ids | set(self._buffer_ids)
+
+    def __contains__(self, record_id: Any) -> bool:
+        return str(record_id) in self._ids or str(record_id) in self._buffer_ids
+
+    def __len__(self) -> int:
+        return len(self._ids) + len(self._buffer_ids)
+
+    def write(self, record: Dict[str, Any]):
+        line = json.dumps(record) + '\n'
+        with self._lock:
+            self._buffer.append(line)
+            self._buffer_ids.append(str(record[self.id_field]))
+            if len(self._buffer) >= self.flush_records or time.monotonic() - self._last_flush >= self.flush_seconds:
+                self._flush()
+
+    def write_many(self, records: Iterable[Dict[str, Any]]):
+        for record in records:
+            self.write(record)
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def _flush(self):
+        self._last_flush = time.monotonic()
+        if not self._buffer:
+            return
+        self._data.write(''.join(self._buffer).encode('utf-8'))
+        self._sync(self._data)
+        self._index.write(self._index_entry(self._buffer_ids, self._data.tell()))
+        self._sync(self._index)
+        self._ids.update(self._buffer_ids)
+        self._buffer, self._buffer_ids = [], []
+
+    def _sync(self, stream):
+        stream.flush()
+        if self.fsync:
+            os.fsync(stream.fileno())
+
+    def _flush_periodically(self):
+        while not self._closed.wait(self.flush_seconds):
+            with self._lock:
+                if self._buffer and time.monotonic() - self._last_flush >= self.flush_seconds:
+                    self._flush()
+
+    def close(self):
+        if self._closed.is_set():
+            return
+        self._closed.set()
+        self.flush()
+        self._data.close()
+        self._index.close()
+
+    def __enter__(self) -> 'JsonlSink':
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
@@ -0,0 +1,173 @@
+from typing import Any, Dict, Optional, Union
+import functools
+import hashlib
+import importlib
+import json
+import pathlib
+import sqlite3
+import threading
+import time
+import zlib
+
+# Arguments of `create` that do not change the answer
+IGNORED_ARGUMENTS = ('max_retries', 'timeout', 'extra_headers', 'stream')
+
+
+class ResponseCache:
+    """
+    Persistent cache of chat completions, keyed by a hash of everything that determines the answer:
+    model, rendered messages, sampling parameters and, for instructor, the JSON schema of the response model.
+
+    Stored in one SQLite file, compressed, and bounded to `max_bytes` by evicting the least recently used entries.
+    """
+
+    def __init__(self, path: Union[str, pathlib.Path], max_bytes: int = 512 * 2**20):
+        self.path = pathlib.Path(path)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(self.path), check_same_thread=False, isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('CREATE TABLE IF NOT EXISTS responses '
+                         '(key TEXT PRIMARY KEY, kind TEXT, value BLOB, size INTEGER, accessed REAL)')
+        self._db.execute('CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)')
+        self._bytes = self._db.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+
+    @staticmethod
+    def key(kwargs: Dict[str, Any]) -> str:
+        request = {name: value for name, value in kwargs.items() if name not in IGNORED_ARGUMENTS}
+        response_model = request.pop('response_model', None)
+        if response_model is not None:
+            request['response_model'] = _schema(response_model)
+        canonical = json.dumps(request, sort_keys=True, separators=(',', ':'), default=str)
+        return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[tuple]:
+        with self._lock:
+            row = self._db.execute('SELECT kind, value FROM responses WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            self.hits += 1
+            self._db.execute('UPDATE responses SET accessed = ? WHERE key = ?', (time.time(), key))
+        return row[0], zlib.decompress(row[1])
+
+    def put(self, key: str, kind: str, value: bytes):
+        blob = zlib.compress(value)
+        with self._lock:
+            self.misses += 1  # every stored answer was requested from the model
+            old = self._db.execute('SELECT size FROM responses WHERE key = ?', (key,)).fetchone()
+            self._db.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)',
+                             (key, kind, blob, len(blob), time.time()))
+            self._bytes += len(blob) - (old[0] if old else 0)
+            if self._bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        # Down to 90% of the bound, so eviction does not run on every insert once full
+        target = self.max_bytes * 0.9
+        rows = self._db.execute('SELECT key, size FROM responses ORDER BY accessed').fetchall()
+        evicted = []
+        for key, size in rows:
+            if self._bytes <= target:
+                break
+            evicted.append((key,))
+            self._bytes -= size
+        self._db.executemany('DELETE FROM responses WHERE key = ?', evicted)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            entries = self._db.execute('SELECT COUNT(*) FROM responses').fetchone()[0]
+        requests = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'hit_rate': self.hits / requests if requests else 0.,
+                'entries': entries, 'bytes': self._bytes}
+
+    def close(self):
+        self._db.close()
+
+
+@functools.lru_cache(maxsize=None)
+def _schema(response_model: Any) -> Dict[str, Any]:
+    return response_model.model_json_schema()
+
+
+def _class_path(obj: Any) -> str:
+    return f'{type(obj).__module__}:{type(obj).__qualname__}'
+
+
+def _load_class(path: str) -> Any:
+    module, qualname = path.split(':')
+    cls = importlib.import_module(module)
+    for name in qualname.split('.'):
+        cls = getattr(cls, name)
+    return cls
+
+
+class _CachedCreate:
+    """
+    `chat.completions.create` looking up the cache first. RateLimiter calls `lookup` itself, to skip the
+    limits on hits, and `uncached` on misses, so every request is looked up once.
+    """
+
+    def __init__(self, create, cache: ResponseCache):
+        self._create = create
+        self._cache = cache
+
+    def lookup(self, **kwargs) -> Any:
+        if kwargs.get('stream'):
+            return None
+        found = self._cache.get(ResponseCache.key(kwargs))
+        if found is None:
+            return None
+        kind, value = found
+        response_model = kwargs.get('response_model')
+        return (response_model or _load_class(kind)).model_validate_json(value)
+
+    def __call__(self, **kwargs) -> Any:
+        cached = self.lookup(**kwargs)
+        if cached is not None:
+            return cached
+        return self.uncached(**kwargs)
+
+    def uncached(self, **kwargs) -> Any:
+        """Sends the request to the model and stores the answer, after a `lookup` missed"""
+        result = self._create(**kwargs)
+        if not kwargs.get('stream'):
+            self._cache.put(ResponseCache.key(kwargs), _class_path(result), result.model_dump_json().encode('utf-8'))
+        return result
+
+
+class _Namespace:
+    pass
+
+
+class CachedClient:
+    """
+    Wraps an `OpenAI()` client or an `instructor.from_openai` client, so that
+    `client.chat.completions.create(...)` answers repeated requests from `cache`.
+    """
+
+    def __init__(self, client: Any, cache: ResponseCache):
+        self.client = client
+        self.chat = _Namespace()
+        self.chat.completions = _Namespace()
+        self.chat.completions.create = _CachedCreate(client.chat.completions.create, cache)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.client, name)
+
+
+def add_arguments(parser, default_path: Union[str, pathlib.Path]):
+    parser.add_argument('--cache', nargs='?', const=str(default_path), default=None, metavar='PATH',
+                        help=f'Answer repeated requests from a response cache, shared between the scripts '
+                             f'(default file: {default_path}). Off by default: reruns send every request to the model')
+    parser.add_argument('--cache-max-mb', type=float, default=512, help='Size bound of the response cache')
+
+
+def from_arguments(args) -> Optional[ResponseCache]:
+    if args.cache is None:
+        return None
+    cache = ResponseCache(args.cache, max_bytes=int(args.cache_max_mb * 2**20))
+    # Cached answers are replayed, not regenerated: say so, as a rerun would otherwise look like a fresh one
+    print(f'Response cache enabled: {cache.path} (run without --cache to send every request to the model)')
+    return cache
@@ -0,0 +1,114 @@
+from typing import Callable, Iterator, List, Optional, Sequence, Tuple, Union
+import pathlib
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# Rows of one part of the corpus, and a function returning the column values at (sorted) rows of that part
+Part = Tuple[int, Callable[[np.ndarray], pa.Array]]
+
+ARROW_SUFFIXES = ('.arrow', '.feather', '.ipc')
+
+
+def _take(values: Union[pa.Array, pa.ChunkedArray], rows: np.ndarray) -> pa.Array:
+    taken = values.take(pa.array(rows))
+    return taken.combine_chunks() if isinstance(taken, pa.ChunkedArray) else taken
+
+
+def _parquet_parts(path: pathlib.Path, column: str) -> List[Part]:
+    # One part per row group: only the groups holding drawn rows are read, and only their `column`
+    parquet = pq.ParquetFile(path)
+    return [(parquet.metadata.row_group(group).num_rows,
+             lambda rows, group=group: _take(parquet.read_row_group(group, columns=[column]).column(column), rows))
+            for group in range(parquet.num_row_groups)]
+
+
+def _read_arrow(path: pathlib.Path) -> pa.Table:
+    """An Arrow file (IPC file or stream format, as in the `datasets` cache), memory-mapped, not read"""
+    source = pa.memory_map(str(path))
+    try:
+        return pa.ipc.open_file(source).read_all()
+    except pa.ArrowInvalid:
+        source.seek(0)
+        return pa.ipc.open_stream(source).read_all()
+
+
+def _column_parts(values: pa.ChunkedArray) -> List[Part]:
+    # One part per chunk: taking from the whole chunked column would concatenate (and read) all of it first
+    return [(len(chunk), lambda rows, chunk=chunk: _take(chunk, rows)) for chunk in values.chunks]
+
+
+def _arrow_parts(path: pathlib.Path, column: str) -> List[Part]:
+    return _column_parts(_read_arrow(path).column(column))
+
+
+def _file_parts(path: pathlib.Path, column: str) -> List[Part]:
+    if path.suffix in ARROW_SUFFIXES:
+        return _arrow_parts(path, column)
+    return _parquet_parts(path, column)
+
+
+def open_parts(source: str, column: str = 'persona', config: Optional[str] = 'persona', split: str = 'train') -> List[Part]:
+    """
+    The parts of a persona corpus: a local Parquet or Arrow file, a directory of them (e.g. a
+    snapshot or `Dataset.save_to_disk`), or the name of a dataset on the Hugging Face hub,
+    loaded once with `datasets` and then read from its memory-mapped Arrow cache files.
+    """
+    path = pathlib.Path(source)
+    if path.is_dir():
+        files = sorted(file for file in path.rglob('*') if file.suffix in ('.parquet', *ARROW_SUFFIXES))
+        if not files:
+            raise FileNotFoundError(f'No Parquet or Arrow files in {path}')
+        return [part for file in files for part in _file_parts(file, column)]
+    if path.exists():
+        return _file_parts(path, column)
+
+    from datasets import load_dataset
+    dataset = load_dataset(source, config, split=split)
+    if dataset.cache_files:
+        return [part for file in dataset.cache_files for part in _arrow_parts(pathlib.Path(file['filename']), column)]
+    return _column_parts(dataset.data.table.column(column))
+
+
+class PersonaSampler:
+    """
+    `count` personas drawn uniformly, with replacement, from a persona corpus.
+
+    The row indices are drawn up front from `seed`, so the same seed gives the same personas,
+    and only those rows of the persona column are read: start-up time and memory depend on
+    `count`, not on the size of the corpus. The drawn personas are kept in one Arrow string
+    array (one contiguous buffer and its offsets) and handed out in the order they were drawn.
+    """
+
+    def __init__(self, source: str, count: int, seed: Union[None, int, Sequence[int]] = None,
+                 column: str = 'persona', config: Optional[str] = 'persona', split: str = 'train'):
+        parts = open_parts(source, column, config, split)
+        self.total = sum(rows for rows, _ in parts)
+        if self.total == 0:
+            raise ValueError(f'No personas in {source}')
+        draws = np.random.default_rng(seed).integers(0, self.total, size=count)
+        # Every drawn row is read once, in corpus order; `_order` maps the draws to them
+        rows, self._order = np.unique(draws, return_inverse=True)
+        chunks, start, taken = [], 0, 0
+        for part_rows, take in parts:
+            end = int(np.searchsorted(rows, start + part_rows))
+            if end > taken:
+                chunks.append(take(rows[taken:end] - start))
+                taken = end
+            start += part_rows
+        self._personas = pa.concat_arrays(chunks) if chunks else pa.array([], pa.string())
+
+    @property
+    def nbytes(self) -> int:
+        return self._personas.nbytes + self._order.nbytes
+
+    def __len__(self) -> int:
+        return len(self._order)
+
+    def __getitem__(self, i: int) -> str:
+        return self._personas[int(self._order[i])].as_py()
+
+    def __iter__(self) -> Iterator[str]:
+        for i in range(len(self)):
+            yield self[i]
@@ -0,0 +1,139 @@
+from typing import Any, AsyncIterator, Awaitable, Callable, Iterable, List, Optional, Tuple
+import asyncio
+import time
+import traceback
+
+_DONE = object()
+
+
+class Stage:
+    """
+    One step of a pipeline: `concurrency` workers apply the coroutine `fn` to the items of
+    the stage's input queue. `fn` returns the item for the next stage, or None to drop it.
+    A failing item is counted in `errors` and dropped, the other items go on.
+
+    With `batch_size` > 1, `fn` gets a list of up to `batch_size` items instead, waiting at
+    most `batch_wait` seconds for the queue to fill a batch, and returns one result per item;
+    a result that is an exception counts as an error of that item.
+    """
+
+    def __init__(self, name: str, fn: Callable[[Any], Awaitable[Any]], concurrency: int = 4,
+                 batch_size: int = 1, batch_wait: float = 0.5):
+        self.name = name
+        self.fn = fn
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.queue: Optional[asyncio.Queue] = None
+        self.done = 0
+        self.errors = 0
+        self.busy = 0
+        self.started: Optional[float] = None
+
+    @property
+    def throughput(self) -> float:
+        """Items per second since the stage got its first item"""
+        if self.started is None:
+            return 0.
+        return self.done / max(time.monotonic() - self.started, 1e-9)
+
+    async def _next_batch(self) -> Tuple[List[Any], bool]:
+        """Up to `batch_size` items, and whether the input is finished"""
+        item = await self.queue.get()
+        if item is _DONE:
+            return [], True
+        batch = [item]
+        deadline = time.monotonic() + self.batch_wait
+        while len(batch) < self.batch_size:
+            try:
+                if self.queue.empty():
+                    item = await asyncio.wait_for(self.queue.get(), max(deadline - time.monotonic(), 0))
+                else:
+                    item = self.queue.get_nowait()
+            except asyncio.TimeoutError:
+                break
+            if item is _DONE:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    async def _work(self, output: asyncio.Queue):
+        while True:
+            if self.batch_size > 1:
+                items, finished = await self._next_batch()
+            else:
+                item = await self.queue.get()
+                items, finished = ([], True) if item is _DONE else ([item], False)
+            if items:
+                if self.started is None:
+                    self.started = time.monotonic()
+                self.busy += len(items)
+                try:
+                    results = await self.fn(items) if self.batch_size > 1 else [await self.fn(items[0])]
+                except Exception:
+                    self.errors += len(items)
+                    traceback.print_exc()
+                    results = []
+                finally:
+                    self.busy -= len(items)
+                for result in results:
+                    if isinstance(result, Exception):
+                        self.errors += 1
+                        traceback.print_exception(type(result), result, result.__traceback__)
+                        continue
+                    self.done += 1
+                    if result is not None:
+                        await output.put(result)
+            if finished:
+                return
+
+    async def run(self, output: asyncio.Queue, downstream_workers: int):
+        await asyncio.gather(*(self._work(output) for _ in range(self.concurrency)))
+        for _ in range(downstream_workers):
+            await output.put(_DONE)
+
+
+def format_metrics(stages: List[Stage]) -> str:
+    """e.g. `labels 1.2/s q=16 | rewrite 1.1/s q=3 | rating 0.9/s q=0 err=1`"""
+    parts = []
+    for stage in stages:
+        part = f'{stage.name} {stage.throughput:.2f}/s q={stage.queue.qsize() if stage.queue else 0}'
+        if stage.errors:
+            part += f' err={stage.errors}'
+        parts.append(part)
+    return ' | '.join(parts)
+
+
+async def run_pipeline(items: Iterable[Any], stages: List[Stage], queue_size: int = 16) -> AsyncIterator[Any]:
+    """
+    Pass `items` through `stages`, connected by queues of at most `queue_size` items,
+    and yield the results of the last stage as they complete.
+
+    Every stage works on different items at the same time, so the second step of an item
+    overlaps with the first step of the next ones, and a slow stage backs up its queue
+    instead of letting the earlier stages run ahead without bound.
+    """
+    for stage in stages:
+        stage.queue = asyncio.Queue(queue_size)
+    output = asyncio.Queue(queue_size)
+
+    async def feed():
+        for item in items:
+            await stages[0].queue.put(item)
+        for _ in range(stages[0].concurrency):
+            await stages[0].queue.put(_DONE)
+
+    tasks = [asyncio.ensure_future(feed())]
+    for stage, after in zip(stages, stages[1:] + [None]):
+        tasks.append(asyncio.ensure_future(stage.run(after.queue if after else output, after.concurrency if after else 1)))
+    try:
+        while True:
+            item = await output.get()
+            if item is _DONE:
+                break
+            yield item
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
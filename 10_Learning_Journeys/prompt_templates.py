@@ -0,0 +1,124 @@
+from typing import Any, Callable, Dict, List, Set, Union
+import re
+import string
+
+_FORMATTER = string.Formatter()
+_ROOT = re.compile(r'[^.\[]*')
+
+Prompt = Union[str, List[Any], Dict[Any, Any]]
+
+
+def fill_prompt_template(prompt: Prompt, **kwargs) -> Prompt:
+    if isinstance(prompt, str):
+        return prompt.format(**kwargs)
+    elif isinstance(prompt, list):
+        return [fill_prompt_template(item, **kwargs) for item in prompt]
+    elif isinstance(prompt, dict):
+        return {key: fill_prompt_template(value, **kwargs) for key, value in prompt.items()}
+    else:
+        return prompt
+
+
+def extract_categories_to_dict(text: str) -> dict:
+    # Split the text into sections based on the numbered list
+    sections = re.split(r'\n(?=\d+\.\s+\*\*)', text)
+    categories_dict = {}
+
+    for section in sections:
+        # Extract the header and the content
+        header_match = re.search(r'\*\*(.*?)\*\*', section)
+        if header_match:
+            header = header_match.group(1).lower().replace(' ', '_')
+            # Remove the header and leading number from the section
+            content = [l.lstrip("1234567890. ") for l in section.splitlines()]
+            categories_dict[header] = '\n'.join(content)
+    return categories_dict
+
+
+def render_categories(info_dict: Dict[str, str], categories: List[str]) -> str:
+    categories = [f"## `{cat}`: {info_dict[cat]}" for cat in categories]
+    return '\n'.join(categories)
+
+
+def _field_getter(field: str, conversion: str, spec: str) -> Callable[[Dict[str, Any]], str]:
+    if field.isidentifier() and not conversion and not spec:
+        return lambda values: format(values[field])
+    # Attribute / index access, conversions and format specs as str.format does them
+    return ('{' + field + (f'!{conversion}' if conversion else '') + (f':{spec}' if spec else '') + '}').format_map
+
+
+def _compile_string(text: str, constants: Dict[str, Any], required: Set[str]) -> Union[str, Callable]:
+    """
+    Substitute the `constants` into `text` now; returns the finished string, or a
+    function joining the constant text between the remaining placeholders with their values.
+    """
+    literals, getters = [''], []
+    for literal, field, spec, conversion in _FORMATTER.parse(text):
+        literals[-1] += literal
+        if field is None:
+            continue
+        root = _ROOT.match(field).group(0)
+        if root in constants and '{' not in (spec or ''):
+            value = _FORMATTER.convert_field(_FORMATTER.get_field(field, (), constants)[0], conversion)
+            literals[-1] += format(value, spec or '')
+        else:
+            required.add(root)
+            getters.append(_field_getter(field, conversion, spec))
+            literals.append('')
+    if not getters:
+        return literals[0]
+    if len(getters) == 1:
+        (prefix, suffix), getter = literals, getters[0]
+        return lambda values: prefix + getter(values) + suffix
+    first, rest = literals[0], list(zip(getters, literals[1:]))
+
+    def render(values: Dict[str, Any]) -> str:
+        parts = [first]
+        for getter, literal in rest:
+            parts.append(getter(values))
+            parts.append(literal)
+        return ''.join(parts)
+    return render
+
+
+def _compile(prompt: Any, constants: Dict[str, Any], required: Set[str]) -> Any:
+    """
+    Returns the constant value of `prompt`, or a callable `render(values)` for prompts with dynamic leaves.
+    """
+    if isinstance(prompt, str):
+        return _compile_string(prompt, constants, required)
+    if isinstance(prompt, list):
+        items = [_compile(item, constants, required) for item in prompt]
+        if not any(callable(item) for item in items):
+            return items
+        return lambda values: [item(values) if callable(item) else item for item in items]
+    if isinstance(prompt, dict):
+        items = [(key, _compile(value, constants, required)) for key, value in prompt.items()]
+        if not any(callable(value) for _, value in items):
+            return dict(items)
+        return lambda values: {key: value(values) if callable(value) else value for key, value in items}
+    return prompt
+
+
+class CompiledPrompt:
+    """
+    A prompt tree (str, or lists and dicts of them, as loaded from the YAML files) parsed once.
+
+    Placeholders given as `constants` (e.g. `company`, `categories`) are substituted at
+    compile time, subtrees without other placeholders are kept as they are, and only the
+    leaves that need per-record values are formatted by `render`. `required` holds the
+    names of those values.
+
+    `CompiledPrompt(prompt, **constants).render(**values)` gives the same result as
+    `fill_prompt_template(prompt, **constants, **values)`. Constant parts of the result are
+    shared between renders, they must not be modified.
+    """
+
+    def __init__(self, prompt: Prompt, **constants):
+        self.required: Set[str] = set()
+        self._compiled = _compile(prompt, constants, self.required)
+
+    def render(self, **values) -> Prompt:
+        if callable(self._compiled):
+            return self._compiled(values)
+        return self._compiled
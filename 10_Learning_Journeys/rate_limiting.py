@@ -0,0 +1,173 @@
+from typing import Any, AsyncIterator, Awaitable, Callable, Iterable, Optional
+import asyncio
+import contextlib
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class TokenBucket:
+    """Refills `per_minute` tokens per minute, holding at most `capacity` (default: one minute's worth)."""
+
+    def __init__(self, per_minute: float, capacity: Optional[float] = None):
+        self.rate = per_minute / 60.
+        self.capacity = capacity or per_minute
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, amount: float = 1):
+        # The lock keeps waiters in FIFO order, so large requests are not starved by small ones
+        async with self._lock:
+            needed = min(amount, self.capacity)
+            while True:
+                self._refill()
+                if self._tokens >= needed:
+                    self._tokens -= amount
+                    return
+                await asyncio.sleep((needed - self._tokens) / self.rate)
+
+    def adjust(self, amount: float):
+        """Take (or give back, if negative) tokens after the fact, e.g. once the real usage is known."""
+        self._refill()
+        self._tokens = min(self.capacity, self._tokens - amount)
+
+
+def estimate_tokens(messages: Any, max_tokens: Optional[int] = None) -> int:
+    # About 4 characters per token, plus the expected completion
+    text = sum(len(str(message.get('content', ''))) for message in messages) if isinstance(messages, list) else len(str(messages))
+    return text // 4 + (max_tokens or 512)
+
+
+def retry_after(error: Exception) -> Optional[float]:
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None) or {}
+    try:
+        if headers.get('retry-after-ms'):
+            return float(headers['retry-after-ms']) / 1000.
+        if headers.get('retry-after'):
+            return float(headers['retry-after'])
+    except ValueError:
+        pass  # an HTTP date, fall back to the backoff
+    return None
+
+
+def is_retryable(error: Exception) -> bool:
+    status = getattr(error, 'status_code', None) or getattr(getattr(error, 'response', None), 'status_code', None)
+    if status is not None:
+        return status in (408, 409, 429) or status >= 500
+    return type(error).__name__ in ('APIConnectionError', 'APITimeoutError', 'ConnectionError', 'TimeoutError')
+
+
+class RateLimiter:
+    """
+    Requests-per-minute and tokens-per-minute budget for one model deployment,
+    with at most `max_in_flight` concurrent calls.
+
+    Blocking clients (OpenAI(), instructor) run in a thread pool of `max_in_flight`
+    threads, so any number of calls can wait for their turn without occupying a thread.
+    A 429 with Retry-After pauses all calls of the limiter, not just the failed one.
+    """
+
+    def __init__(self, requests_per_minute: float, tokens_per_minute: Optional[float] = None,
+                 max_in_flight: int = 8, max_retries: int = 6, backoff: float = 1.0, max_backoff: float = 60.):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.max_in_flight = max_in_flight
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self._semaphore = asyncio.Semaphore(max_in_flight)
+        self._executor = ThreadPoolExecutor(max_in_flight)
+        self._paused_until = 0.
+        self.stats = {'calls': 0, 'retries': 0, 'errors': 0, 'tokens': 0}
+
+    def pause(self, seconds: float):
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    @contextlib.asynccontextmanager
+    async def slot(self, tokens: int = 0):
+        async with self._semaphore:
+            while time.monotonic() < self._paused_until:
+                await asyncio.sleep(self._paused_until - time.monotonic())
+            await self.requests.acquire(1)
+            if self.tokens is not None:
+                await self.tokens.acquire(tokens)
+            yield
+
+    def _delay(self, error: Exception, attempt: int) -> float:
+        delay = retry_after(error)
+        if delay is not None:
+            self.pause(delay)
+            return delay + random.uniform(0, min(delay, 1.))
+        # Full jitter exponential backoff
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    async def call(self, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """
+        Run the blocking `fn(*args, **kwargs)` (e.g. `client.chat.completions.create`) within the limits,
+        retrying throttled and transient errors.
+        """
+        # Cached answers (llm_cache.CachedClient) do not count against the limits
+        lookup = getattr(fn, 'lookup', None)
+        if lookup is not None:
+            cached = lookup(*args, **kwargs)
+            if cached is not None:
+                return cached
+            fn = fn.uncached
+        estimated = estimate_tokens(kwargs.get('messages', ''), kwargs.get('max_tokens'))
+        loop = asyncio.get_running_loop()
+        for attempt in range(self.max_retries + 1):
+            async with self.slot(estimated):
+                try:
+                    result = await loop.run_in_executor(self._executor, lambda: fn(*args, **kwargs))
+                except Exception as error:
+                    if attempt == self.max_retries or not is_retryable(error):
+                        self.stats['errors'] += 1
+                        raise
+                    delay = self._delay(error, attempt)
+                else:
+                    self.stats['calls'] += 1
+                    self._account(result, estimated)
+                    return result
+            self.stats['retries'] += 1
+            await asyncio.sleep(delay)
+
+    def _account(self, result: Any, estimated: int):
+        # instructor returns the parsed model and keeps the completion in `_raw_response`
+        usage = getattr(getattr(result, '_raw_response', result), 'usage', None)
+        used = getattr(usage, 'total_tokens', None)
+        if used is None:
+            used = estimated
+        elif self.tokens is not None:
+            self.tokens.adjust(used - estimated)
+        self.stats['tokens'] += used
+
+
+async def map_unordered(fn: Callable[[Any], Awaitable[Any]], items: Iterable[Any], limit: int) -> AsyncIterator[Any]:
+    """
+    Yield `await fn(item)` as they complete, with at most `limit` pending at a time (items are consumed lazily).
+    When a call raises, or the caller stops iterating, the pending calls are cancelled and awaited first.
+    """
+    items = iter(items)
+    pending = set()
+    try:
+        while True:
+            for item in items:
+                pending.add(asyncio.ensure_future(fn(item)))
+                if len(pending) >= limit:
+                    break
+            if not pending:
+                return
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+    finally:
+        for future in pending:
+            future.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
@@ -1,14 +1,23 @@
-from typing import Literal, Type, Union, Dict, Any, List, Callable
+from typing import Annotated, Literal, Type, Union, Dict, Any, List, Callable, Tuple
 import re
+import functools
 from enum import Enum
 import pathlib
 import instructor
 from datasets import load_dataset
-from pydantic import BaseModel, create_model
+from pydantic import BaseModel, ValidationError, WithJsonSchema, create_model
 import yaml
 import json
+import asyncio
+import argparse
 from tqdm.auto import tqdm
 
+from jsonl_sink import JsonlSink
+import llm_cache
+from prompt_templates import CompiledPrompt, extract_categories_to_dict, render_categories
+from pipeline import Stage, format_metrics, run_pipeline
+from rate_limiting import RateLimiter
+
 HERE = pathlib.Path(__file__).parent
 
 
@@ -39,37 +48,14 @@ class Urgency(str, Enum):
     MEDIUM = 'medium'
     HIGH = 'high'
 
-def fill_prompt_template(prompt: Union[str, List[Any], Dict[Any, Any]], **kwargs) -> Union[str, List[Any], Dict[Any, Any]]:
-    if isinstance(prompt, str):
-        return prompt.format(**kwargs)
-    elif isinstance(prompt, list):
-        return [fill_prompt_template(item, **kwargs) for item in prompt]
-    elif isinstance(prompt, dict):
-        return {key: fill_prompt_template(value, **kwargs) for key, value in prompt.items()}
-    else:
-        return prompt
-
-
-def extract_categories_to_dict(text: str) -> dict:
-    # Split the text into sections based on the numbered list
-    sections = re.split(r'\n(?=\d+\.\s+\*\*)', text)
-    categories_dict = {}
-
-    for section in sections:
-        # Extract the header and the content
-        header_match = re.search(r'\*\*(.*?)\*\*', section)
-        if header_match:
-            header = header_match.group(1).lower().replace(' ', '_')
-            # Remove the header and leading number from the section
-            content = [l.lstrip("1234567890. ") for l in section.splitlines()]
-            categories_dict[header] = '\n'.join(content)
-    return categories_dict
 
-
-if __name__ == '__main__':
-    from gen_ai_hub.proxy.native.openai import OpenAI
-
-    MODEL = 'gpt-4o'
+async def main(args):
+    if args.base_url:
+        from openai import OpenAI
+        client = OpenAI(base_url=args.base_url, api_key='stub', max_retries=0)
+    else:
+        from gen_ai_hub.proxy.native.openai import OpenAI
+        client = OpenAI()
 
     with (HERE / 'rewrite-messages.yaml').open() as stream:
         prompts = yaml.safe_load(stream)
@@ -90,81 +76,150 @@ if __name__ == '__main__':
     fields = {cat: (bool, ...) for cat in categories}
     fields["urgency"] = (Urgency, ...)
     MultiLabelResponse = create_model("AssignedCategories", **fields)
+    # Batched requests: the items are validated one by one against MultiLabelResponse, so that
+    # one malformed item does not fail (and retry) the whole batch. The schema still describes them.
+    item_fields = {"index": (int, ...), **{cat: (bool, ...) for cat in categories},
+                   "urgency": (Literal[tuple(urgency.value for urgency in Urgency)], ...)}
+    item_schema = create_model("AssignedCategoriesItem", **item_fields).model_json_schema()
+    MultiLabelBatchResponse = create_model(
+        "AssignedCategoriesBatch",
+        items=(List[Annotated[Dict[str, Any], WithJsonSchema(item_schema)]], ...)
+    )
 
-    client = OpenAI()
     instructor_client = instructor.from_openai(client)
-
+    cache = llm_cache.from_arguments(args)
+    if cache is not None:
+        client = llm_cache.CachedClient(client, cache)
+        instructor_client = llm_cache.CachedClient(instructor_client, cache)
 
     output_file = HERE / 'mails-v4.jsonl'
-    if output_file.exists():
-        known_ids = set([entry["id"] for entry in load_dataset("json", data_files=[str(output_file)], split='train')])
-    else:
-        known_ids = set()
+    # Ids already rewritten, read from the sink's index (`mails-v4.jsonl.ids`) to resume
+    sink = JsonlSink(output_file)
+    known_ids = sink.completed_ids()
 
     dataset = load_dataset("json", data_files=["mails-v2.jsonl"], split='train')
-
-    kwargs = {
-        "company": company_description,
-    }
-
-    new_messages = []
-
-    def render_categories(info_dict: Dict[str, str], categories: List[str]) -> str:
-        categories = [f"## `{cat}`: {info_dict[cat]}" for cat in categories]
-        return '\n'.join(categories)
-
-    for entry in tqdm(dataset):
-        if entry["id"] in known_ids:
-            continue
+    if known_ids:
+        # Drop finished entries looking at the id column only, instead of materialising every row in the loop
+        dataset = dataset.filter(lambda ids: [i not in known_ids for i in ids], input_columns='id',
+                                 batched=True, keep_in_memory=True)
+
+    # Compiled once: the company, category and urgency descriptions are the same for every entry
+    assign_labels_prompt = CompiledPrompt(
+        prompts["assign-labels"],
+        urgency_description=render_categories(urgency_dict, urgency_dict.keys()),
+        categories=render_categories(category_dict, category_dict.keys())
+    )
+    assign_labels_batch_prompt = CompiledPrompt(
+        prompts["assign-labels-batch"],
+        urgency_description=render_categories(urgency_dict, urgency_dict.keys()),
+        categories=render_categories(category_dict, category_dict.keys())
+    )
+    rewrite_prompt = CompiledPrompt(prompts["rewrite-message"], company=company_description)
+    rating_prompt = CompiledPrompt(prompts["quality_rating"], company=company_description)
+
+    @functools.lru_cache(maxsize=None)
+    def render_subset(info: str, names: Tuple[str, ...]) -> str:
+        return render_categories(category_dict if info == 'categories' else urgency_dict, names)
+
+    # One limiter per stage; stages calling the same deployment split its quota between them
+    labels_limiter = RateLimiter(args.labels_rpm, max_in_flight=args.labels_concurrency)
+    rewrite_limiter = RateLimiter(args.rewrite_rpm, max_in_flight=args.rewrite_concurrency)
+    rating_limiter = RateLimiter(args.rating_rpm, max_in_flight=args.rating_concurrency)
+
+    async def classify(entry):
+        formatted_prompt = assign_labels_prompt.render(message=entry["message"])
+        return (await labels_limiter.call(
+            instructor_client.chat.completions.create,
+            model='gpt-4o',
+            messages=formatted_prompt,
+            response_model=MultiLabelResponse,
+            temperature=0.0,
+        )).model_dump()
+
+    requeued = 0
+
+    async def classify_batch(entries):
+        """
+        One request for all `entries`; the entries whose item is missing or invalid in the
+        answer are sent again on their own. Returns a classification or the exception per entry.
+        """
+        nonlocal requeued
+        messages = ''.join(f'Message {i}:\n---\n{entry["message"]}\n---\n' for i, entry in enumerate(entries))
+        response = await labels_limiter.call(
+            instructor_client.chat.completions.create,
+            model='gpt-4o',
+            messages=assign_labels_batch_prompt.render(messages=messages, count=len(entries)),
+            response_model=MultiLabelBatchResponse,
+            temperature=0.0,
+        )
+        classifications = [None] * len(entries)
+        for item in response.items:
+            index = item.get("index")
+            if not isinstance(index, int) or not 0 <= index < len(entries) or classifications[index] is not None:
+                continue
+            try:
+                classifications[index] = MultiLabelResponse.model_validate(item).model_dump()
+            except ValidationError:
+                pass
+        missing = [i for i, classification in enumerate(classifications) if classification is None]
+        requeued += len(missing)
+        retried = await asyncio.gather(*(classify(entries[i]) for i in missing), return_exceptions=True)
+        for i, classification in zip(missing, retried):
+            classifications[i] = classification
+        return classifications
+
+    def labelled(entry, classification):
         if "sentiment" in entry:
             sentiment = entry["sentiment"].split('.')[-1].lower()
         elif "sentiment" in entry["ground_truth"]:
             sentiment = entry["ground_truth"]["sentiment"].split('.')[-1].lower()
 
-        formatted_prompt = fill_prompt_template(
-            prompts["assign-labels"],
-            message=entry["message"],
-            urgency_description=render_categories(urgency_dict, urgency_dict.keys()),
-            categories=render_categories(category_dict, category_dict.keys())
-        )
-        classification = instructor_client.chat.completions.create(
-            model='gpt-4o',
-            messages=formatted_prompt,
-            response_model=MultiLabelResponse,
-            temperature=0.0,
-        ).model_dump()
-        print(f'{classification=}')
         urgency_assigned = classification.pop("urgency").value.lower()
         categories_assigned = [k for k, v in classification.items() if v]
-        categories_avoided = list(set(categories) - set(categories_assigned))
-        urgency_avoided = list(set([*urgency_dict.keys()]) - set([urgency_assigned]))
+        # In the order of the descriptions, so the same labels always give the same prompt
+        categories_avoided = [cat for cat in categories if cat not in categories_assigned]
+        urgency_avoided = [urgency for urgency in urgency_dict if urgency != urgency_assigned]
 
         inputs ={
-                "categories_avoided_full": render_categories(category_dict, categories_avoided),
+                "categories_avoided_full": render_subset("categories", tuple(categories_avoided)),
                 "categories_avoided": ', '.join(categories_avoided),
-                "categories_assigned_full": render_categories(category_dict, categories_assigned),
+                "categories_assigned_full": render_subset("categories", tuple(categories_assigned)),
                 "categories_assigned": ', '.join(categories_assigned),
-                "urgency_avoided_full": render_categories(urgency_dict, urgency_avoided),
+                "urgency_avoided_full": render_subset("urgency", tuple(urgency_avoided)),
                 "urgency_avoided": ', '.join(urgency_avoided),
-                "urgency_assigned_full": render_categories(urgency_dict, [urgency_assigned]),
+                "urgency_assigned_full": render_subset("urgency", (urgency_assigned,)),
                 "urgency_assigned": urgency_assigned,
                 "sentiment": sentiment,
                 "persona": entry["persona"],
                 "message": entry["message"],
-                **kwargs,
                 #**entry
             }
-        mail = client.chat.completions.create(
+        return entry, inputs, categories_assigned
+
+    async def assign_labels(entry):
+        return labelled(entry, await classify(entry))
+
+    async def assign_labels_batch(entries):
+        classifications = await classify_batch(entries)
+        return [classification if isinstance(classification, Exception) else labelled(entry, classification)
+                for entry, classification in zip(entries, classifications)]
+
+    async def rewrite_message(item):
+        entry, inputs, categories_assigned = item
+        mail = await rewrite_limiter.call(
+            client.chat.completions.create,
             model='gpt-4o',
-            messages=fill_prompt_template(prompts["rewrite-message"], **inputs),
+            messages=rewrite_prompt.render(**inputs),
             temperature=0.0,
         )
-        new_message = mail.choices[0].message.content
-
+        return entry, inputs, categories_assigned, mail.choices[0].message.content
 
-        rating = instructor_client.chat.completions.create(
+    async def rate_quality(item):
+        entry, inputs, categories_assigned, new_message = item
+        rating = await rating_limiter.call(
+            instructor_client.chat.completions.create,
             model='gpt-4',
-            messages=fill_prompt_template(prompts["quality_rating"], **inputs),
+            messages=rating_prompt.render(**inputs),
             response_model=Match,
             temperature=0.0,
         )
@@ -173,8 +228,8 @@ if __name__ == '__main__':
             "persona": entry["persona"],
             "ground_truth": {
                 "categories": categories_assigned,
-                "sentiment": sentiment,
-                "urgency": urgency_assigned,
+                "sentiment": inputs["sentiment"],
+                "urgency": inputs["urgency_assigned"],
             },
             "quality_score": rating.score,
             "generation_quality": rating.model_dump(),
@@ -185,5 +240,34 @@ if __name__ == '__main__':
         else:
             revised_entry["message"] = new_message
             revised_entry["original_message"] = entry["message"]
-        with output_file.open('a') as stream:
-            stream.write(json.dumps(revised_entry)+'\n')
+        return revised_entry
+
+    stages = [
+        Stage('labels', assign_labels_batch if args.labels_batch_size > 1 else assign_labels,
+              args.labels_concurrency, batch_size=args.labels_batch_size),
+        Stage('rewrite', rewrite_message, args.rewrite_concurrency),
+        Stage('rating', rate_quality, args.rating_concurrency),
+    ]
+    with sink, tqdm(total=len(dataset)) as progress:
+        async for revised_entry in run_pipeline(dataset, stages, queue_size=args.queue_size):
+            sink.write(revised_entry)
+            progress.update(1)
+            progress.set_postfix_str(format_metrics(stages), refresh=False)
+    print(format_metrics(stages))
+    if args.labels_batch_size > 1:
+        print(f'Labels sent again on their own: {requeued}')
+    if cache is not None:
+        print(f'Response cache: {cache.stats()}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    for stage, rpm, concurrency in (('labels', 30, 4), ('rewrite', 30, 4), ('rating', 20, 4)):
+        parser.add_argument(f'--{stage}-rpm', type=float, default=rpm, help=f'Requests per minute of the {stage} stage')
+        parser.add_argument(f'--{stage}-concurrency', type=int, default=concurrency, help=f'Concurrent requests of the {stage} stage')
+    parser.add_argument('--labels-batch-size', type=int, default=1,
+                        help='Messages classified per labels request; the system prompt and categories are sent once per batch')
+    parser.add_argument('--queue-size', type=int, default=16, help='Items waiting between two stages at most')
+    llm_cache.add_arguments(parser, HERE / '.llm-cache.sqlite')
+    parser.add_argument('--base-url', default=None, help='OpenAI compatible endpoint instead of the generative AI hub, e.g. stub_openai_server.py')
+    asyncio.run(main(parser.parse_args()))
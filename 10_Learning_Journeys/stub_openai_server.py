@@ -0,0 +1,139 @@
+"""
+Local stand-in for an OpenAI compatible `/chat/completions` endpoint, to exercise the
+generation scripts (concurrency, rate limits, retries) without a model deployment:
+
+    python stub_openai_server.py --port 8000 --latency 0.5 --requests-per-minute 120
+    python bootstrap_mails.py --base-url http://127.0.0.1:8000/v1 --count 50
+
+Requests above the per-minute budget (or a random `--error-rate` share of them) get a
+429 with Retry-After. Requests with `tools` (instructor) get a tool call with arguments
+that satisfy the schema; others get a fixed text answer.
+"""
+from typing import Any, Dict, Optional
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def example_for(schema: Dict[str, Any], defs: Dict[str, Any]) -> Any:
+    if '$ref' in schema:
+        return example_for(defs[schema['$ref'].split('/')[-1]], defs)
+    for key in ('anyOf', 'oneOf', 'allOf'):
+        if key in schema:
+            return example_for(schema[key][0], defs)
+    if 'enum' in schema:
+        return schema['enum'][0]
+    if 'const' in schema:
+        return schema['const']
+    kind = schema.get('type', 'object')
+    if kind == 'object':
+        return {name: example_for(prop, defs) for name, prop in schema.get('properties', {}).items()}
+    if kind == 'array':
+        return [example_for(schema.get('items', {}), defs) for _ in range(schema.get('minItems', 1))]
+    return {'string': 'stub', 'integer': 0, 'number': 0.0, 'boolean': False, 'null': None}.get(kind)
+
+
+class StubState:
+
+    def __init__(self, latency: float, requests_per_minute: float, error_rate: float, retry_after: float):
+        self.latency = latency
+        self.requests_per_minute = requests_per_minute
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.lock = threading.Lock()
+        self.window = deque()
+        self.counts = {'ok': 0, 'throttled': 0}
+
+    def admit(self) -> Optional[float]:
+        """Returns None if the request is admitted, or the seconds to wait before retrying"""
+        with self.lock:
+            now = time.monotonic()
+            while self.window and self.window[0] < now - 60:
+                self.window.popleft()
+            if self.requests_per_minute and len(self.window) >= self.requests_per_minute:
+                self.counts['throttled'] += 1
+                return self.window[0] + 60 - now
+            if random.random() < self.error_rate:
+                self.counts['throttled'] += 1
+                return self.retry_after
+            self.window.append(now)
+            self.counts['ok'] += 1
+            return None
+
+
+def completion(request: Dict[str, Any]) -> Dict[str, Any]:
+    message = {'role': 'assistant', 'content': 'Stub answer.'}
+    finish_reason = 'stop'
+    if request.get('tools'):
+        function = request['tools'][0]['function']
+        schema = function.get('parameters', {})
+        arguments = example_for(schema, schema.get('$defs', {}))
+        message = {'role': 'assistant', 'content': None, 'tool_calls': [{
+            'id': f'call_{uuid.uuid4().hex[:12]}', 'type': 'function',
+            'function': {'name': function['name'], 'arguments': json.dumps(arguments)}}]}
+        finish_reason = 'tool_calls'
+    prompt_tokens = sum(len(str(m.get('content') or '')) for m in request.get('messages', [])) // 4
+    return {
+        'id': f'chatcmpl-{uuid.uuid4().hex}', 'object': 'chat.completion', 'created': int(time.time()),
+        'model': request.get('model', 'stub'),
+        'choices': [{'index': 0, 'message': message, 'finish_reason': finish_reason}],
+        'usage': {'prompt_tokens': prompt_tokens, 'completion_tokens': 16, 'total_tokens': prompt_tokens + 16},
+    }
+
+
+def make_handler(state: StubState):
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def _reply(self, status: int, body: Dict[str, Any], headers: Optional[Dict[str, str]] = None):
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_POST(self):
+            request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+            if not self.path.rstrip('/').endswith('/chat/completions'):
+                return self._reply(404, {'error': {'message': f'Unknown path {self.path}'}})
+            wait = state.admit()
+            if wait is not None:
+                return self._reply(429, {'error': {'message': 'Rate limit reached', 'type': 'rate_limit_exceeded'}},
+                                   {'Retry-After': f'{wait:.3f}'})
+            time.sleep(state.latency)
+            self._reply(200, completion(request))
+
+        def do_GET(self):
+            self._reply(200, state.counts)
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--latency', type=float, default=0.5, help='Seconds per completion')
+    parser.add_argument('--requests-per-minute', type=float, default=0, help='Throttle above this, 0 for no limit')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Share of requests answered with 429 anyway')
+    parser.add_argument('--retry-after', type=float, default=1.0, help='Retry-After of the random 429s')
+    args = parser.parse_args()
+    state = StubState(args.latency, args.requests_per_minute, args.error_rate, args.retry_after)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(state))
+    print(f'Stub OpenAI server on http://{args.host}:{args.port}/v1')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print(state.counts)
@@ -1,131 +1,186 @@
-from typing import Dict
-import re
-import pathlib
-import sys
+"""
+The prompt variants of `example-prompts.yaml`, from `01_basic` to `08_complete`.
+
+    python unit_2_prompts.py 3              # send every variant for mail 3 and print the answers
+    python unit_2_prompts.py --evaluate     # score every variant on every mail
+
+The evaluation sends all (variant, mail) requests concurrently within the rate limit,
+parses the answers as JSON and writes the per-variant valid-JSON rate and accuracy of
+category, sentiment and urgency to `prompt-evaluation.csv`.
+"""
+from typing import Any, Dict, List, Optional
+import argparse
+import asyncio
 import json
+import pathlib
 
+import pandas as pd
 import yaml
 
-from gen_ai_hub.proxy.native.openai import OpenAI
+import llm_cache
+from prompt_templates import CompiledPrompt, extract_categories_to_dict
+from rate_limiting import RateLimiter, map_unordered
 
 HERE = pathlib.Path(__file__).parent
 PRINT_FORMATTED_PROMPT = True
-MESSAGE_IDX = int(sys.argv[1]) if len(sys.argv) > 1 else 0
+FIELDS = ('category', 'sentiment', 'urgency')
 
-with (HERE / 'example-prompts.yaml').open() as stream:
-    prompts = yaml.safe_load(stream)
 
-with (HERE / 'mails-v2.json').open() as stream:
-    mails = [json.loads(line) for line in stream if line.strip()]
+def load_inputs(mails_path: pathlib.Path):
+    with (HERE / 'example-prompts.yaml').open() as stream:
+        prompts = yaml.safe_load(stream)
 
-with (HERE / 'service-categories.md').open() as stream:
-    categories = stream.read()
+    with mails_path.open() as stream:
+        mails = [json.loads(line) for line in stream if line.strip()]
 
-mail = mails[MESSAGE_IDX]
+    with (HERE / 'service-categories.md').open() as stream:
+        categories = stream.read()
+    categories_dict = extract_categories_to_dict(categories)
 
+    # Variants 06 to 08 also get the category descriptions and names, the others only the message
+    compiled = {key: CompiledPrompt(prompt, categories=categories, categories_list=', '.join([*categories_dict.keys()]))
+                for key, prompt in prompts.items()}
+    return prompts, compiled, mails
 
-client = OpenAI()
 
-def send_request(prompt, message,**kwargs) -> str:
-    formatted_prompt = prompt.format(message=message, **kwargs)
-    response = client.chat.completions.create(
-        model='gpt-4o',
+def send_request(client, prompt: CompiledPrompt, message: str, model: str = 'gpt-4o') -> str:
+    formatted_prompt = prompt.render(message=message)
+    return client.chat.completions.create(
+        model=model,
         messages=[{"role": "user", "content": formatted_prompt}],
         temperature=0.0,
     ).choices[0].message.content
-    print(f"<-- PROMPT --->\n{formatted_prompt if PRINT_FORMATTED_PROMPT else prompt}\n<--- RESPONSE --->\n{response}")
-    return response
-
-
-key = "01_basic"
-print(f"###\n\t{key}\n###")
-response = send_request(prompts[key], mail["message"])
-
-key = "02_sentiment_urgency_choices"
-print(f"###\n\t{key}\n###")
-response = send_request(prompts[key], mail["message"])
-
-key = "03_sentiment_urgency_choices_as_json"
-print(f"###\n\t{key}\n###")
-response = send_request(prompts[key], mail["message"])
-
-key = "04_sentiment_urgency_choices_as_json_no_wrapping"
-print(f"###\n\t{key}\n###")
-response = send_request(prompts[key], mail["message"])
-
-key = "05_assign_category"
-print(f"###\n\t{key}\n###")
-response = send_request(prompts[key], mail["message"])
-
-
-key = "06_assign_category_with_description"
-print(f"###\n\t{key}\n###")
-response = send_request(prompts[key], mail["message"], categories=categories)
-
-key = "07_assign_category_with_description_json"
-print(f"###\n\t{key}\n###")
-
-
-def extract_categories_to_dict(text: str) -> dict:
-    # Split the text into sections based on the numbered list
-    sections = re.split(r'\n(?=\d+\.\s+\*\*)', text)
-    categories_dict = {}
-
-    for section in sections:
-        # Extract the header and the content
-        header_match = re.search(r'\*\*(.*?)\*\*', section)
-        if header_match:
-            header = header_match.group(1).lower().replace(' ', '_')
-            # Remove the header and leading number from the section
-            content = [l.lstrip("1234567890. ") for l in section.splitlines()]
-            categories_dict[header] = '\n'.join(content)
-    return categories_dict
-
-categories_dict = extract_categories_to_dict(categories)
-response = send_request(prompts[key], mail["message"], categories=categories, categories_list=', '.join([*categories_dict.keys()]))
-
-
-key = "08_complete"
-print(f"###\n\t{key}\n###")
-response = send_request(prompts[key], mail["message"], categories=categories, categories_list=', '.join([*categories_dict.keys()]))
-
-
-### Evaluation
 
-def evaluation(mail: Dict[str, str], response: str):
-    is_valid_json = False
-    is_correct_category = False
-    is_correct_sentiment = False
-    is_correct_urgency = False
 
+def parse_response(response: Optional[str]) -> Dict[str, Any]:
+    """The answer's category, sentiment and urgency, and whether it was a valid JSON object"""
     try:
         result = json.loads(response)
-    except json.JSONDecodeError:
-        is_valid_json = False
+    except (TypeError, json.JSONDecodeError):
+        result = None
+    if not isinstance(result, dict):
+        return {"valid_json": False}
+    return {"valid_json": True, **{field: result.get(field) for field in FIELDS}}
+
+
+def ground_truth(mails: List[Dict[str, Any]]) -> pd.DataFrame:
+    rows = []
+    for idx, mail in enumerate(mails):
+        truth = mail["ground_truth"]
+        # One category, or a list of them (rewritten mails), any of which counts as correct
+        categories = truth.get("categories") or [truth.get("category")]
+        rows.append({"mail": idx, "categories": categories,
+                     "sentiment": str(truth.get("sentiment", '')).split('.')[-1].lower(),
+                     "urgency": str(truth.get("urgency", '')).split('.')[-1].lower()})
+    return pd.DataFrame(rows)
+
+
+def score(results: pd.DataFrame, truth: pd.DataFrame) -> pd.DataFrame:
+    """
+    Returns:
+        One row per variant: requests, failed requests, valid JSON rate and accuracy per field
+        (NaN for fields the variant never returns).
+    """
+    df = results.merge(truth, on="mail", suffixes=("", "_true"))
+    for field in FIELDS:
+        if field not in df:
+            df[field] = None
+    normalized = {field: df[field].astype("string").str.strip().str.lower() for field in FIELDS}
+    df["sentiment_correct"] = normalized["sentiment"] == df["sentiment_true"]
+    df["urgency_correct"] = normalized["urgency"] == df["urgency_true"]
+    # Category: explode the true categories, compare, and reduce back to one row per request
+    exploded = df[["variant", "mail", "categories"]].assign(category=normalized["category"]).explode("categories")
+    exploded["hit"] = exploded["category"] == exploded["categories"].astype("string").str.lower()
+    df["category_correct"] = exploded.groupby(level=0)["hit"].any()
+
+    for field in FIELDS:
+        df[f"{field}_correct"] = df[f"{field}_correct"].fillna(False).astype(bool)
+        df[f"{field}_answered"] = df[field].notna()
+
+    grouped = df.groupby("variant")
+    table = pd.DataFrame({
+        "requests": grouped.size(),
+        "failed": grouped["failed"].sum(),
+        "valid_json_rate": grouped["valid_json"].mean(),
+    })
+    for field in FIELDS:
+        table[f"{field}_accuracy"] = grouped[f"{field}_correct"].mean().where(grouped[f"{field}_answered"].any())
+    return table.sort_index()
+
+
+async def evaluate(client, compiled: Dict[str, CompiledPrompt], mails: List[Dict[str, Any]], variants: List[str],
+                   limiter: RateLimiter, model: str) -> pd.DataFrame:
+    async def run(job):
+        variant, idx = job
+        try:
+            response = await limiter.call(
+                client.chat.completions.create,
+                model=model,
+                messages=[{"role": "user", "content": compiled[variant].render(message=mails[idx]["message"])}],
+                temperature=0.0,
+            )
+        except Exception as error:
+            print(f"{variant} mail {idx}: {error}")
+            return {"variant": variant, "mail": idx, "failed": True, "valid_json": False}
+        return {"variant": variant, "mail": idx, "failed": False, **parse_response(response.choices[0].message.content)}
+
+    jobs = [(variant, idx) for variant in variants for idx in range(len(mails))]
+    results = []
+    async for row in map_unordered(run, jobs, limit=2 * limiter.max_in_flight):
+        results.append(row)
+        if len(results) % 100 == 0 or len(results) == len(jobs):
+            print(f"{len(results)}/{len(jobs)} requests")
+    return pd.DataFrame(results)
+
+
+async def main(args):
+    if args.base_url:
+        from openai import OpenAI
+        client = OpenAI(base_url=args.base_url, api_key='stub', max_retries=0)
     else:
-        is_valid_json = True
-        is_correct_category = result["category"] == mail["ground_truth"]["category"]
-        is_correct_sentiment = result["sentiment"] == mail["ground_truth"]["sentiment"]
-        is_correct_urgency = result["urgency"] == mail["ground_truth"]["urgency"]
-
-    print(f"<-- Evaluation -->\n\t{is_valid_json=}\n\t{is_correct_category=}\n\t{is_correct_sentiment=}\n\t{is_correct_urgency=}")
-    return is_valid_json, is_correct_category, is_correct_sentiment, is_correct_urgency
-
-
-        print(f"\n\t{is_valid_json=}
-        print(f"\n\t{is_correct_category=}")
-        print(f"\n\t{is_correct_sentiment=}")
-        print(f"\n\t{is_correct_urgency=}")")
-print(evaluation(mail, response))
-
-
-n_valid_json = 0
-n_correct_sentiment = 0
-n_correct_category = 0
-n_correct_urgency = 0
-for main in mails:
-    is_valid_json, is_correct_category, is_correct_sentiment, is_correct_urgency = evaluation(mail, f_8)
-    n_valid_json += is_valid_json
-    n_correct_sentiment += is_correct_sentiment
-    n_correct_category += is_correct_category
-    n_correct_urgency += is_correct_urgency
+        from gen_ai_hub.proxy.native.openai import OpenAI
+        client = OpenAI()
+    cache = llm_cache.from_arguments(args)
+    if cache is not None:
+        client = llm_cache.CachedClient(client, cache)
+
+    prompts, compiled, mails = load_inputs(pathlib.Path(args.mails))
+    variants = args.variants.split(',') if args.variants else list(prompts)
+
+    if not args.evaluate:
+        mail = mails[args.message_idx]
+        for key in variants:
+            print(f"###\n\t{key}\n###")
+            response = send_request(client, compiled[key], mail["message"], args.model)
+            formatted_prompt = compiled[key].render(message=mail["message"])
+            print(f"<-- PROMPT --->\n{formatted_prompt if PRINT_FORMATTED_PROMPT else prompts[key]}\n<--- RESPONSE --->\n{response}")
+            print(f"<-- Evaluation -->\n\t{parse_response(response)}")
+        return
+
+    if args.limit:
+        mails = mails[:args.limit]
+    limiter = RateLimiter(args.requests_per_minute, args.tokens_per_minute, max_in_flight=args.max_in_flight)
+    results = await evaluate(client, compiled, mails, variants, limiter, args.model)
+    table = score(results, ground_truth(mails))
+    table.to_csv(args.output)
+    print(table.to_string(float_format="{:.3f}".format))
+    print(limiter.stats)
+    if cache is not None:
+        print(f"Response cache: {cache.stats()}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('message_idx', type=int, nargs='?', default=0, help='Mail to send the variants for')
+    parser.add_argument('--evaluate', action='store_true', help='Score the variants on all mails')
+    parser.add_argument('--variants', default=None, help='Comma separated prompt keys, all by default')
+    parser.add_argument('--mails', default=str(HERE / 'mails-v2.json'))
+    parser.add_argument('--limit', type=int, default=None, help='Only evaluate the first mails')
+    parser.add_argument('--model', default='gpt-4o')
+    parser.add_argument('--requests-per-minute', type=float, default=60)
+    parser.add_argument('--tokens-per-minute', type=float, default=None)
+    parser.add_argument('--max-in-flight', type=int, default=16)
+    parser.add_argument('--output', default=str(HERE / 'prompt-evaluation.csv'))
+    llm_cache.add_arguments(parser, HERE / '.llm-cache.sqlite')
+    parser.add_argument('--base-url', default=None, help='OpenAI compatible endpoint instead of the generative AI hub, e.g. stub_openai_server.py')
+    asyncio.run(main(parser.parse_args()))